@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Description Telegram returns for a user who blocked the bot
+BLOCKED_DESCRIPTION = "Forbidden: bot was blocked by the user"
+
+
+class FakeBotAPI:
+    """
+    Local stand-in for the Telegram Bot API. Answers every method the bot uses
+    with a plausible result, counts calls per method and can simulate latency
+    and blocked chats. Point a bot at it with
+    AiohttpSession(api=TelegramAPIServer.from_base(server.base_url)).
+    """
+
+    def __init__(self, latency: float = 0.0, blocked_chats=()):
+        self.latency = latency
+        self.blocked_chats = set(blocked_chats)
+        self.calls = Counter()
+        self._message_id = 0
+        self._runner = None
+        self.base_url = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        self.calls.clear()
+
+    def _message(self, chat_id: int, **extra) -> dict:
+        self._message_id += 1
+        chat_type = "private" if chat_id > 0 else "supergroup"
+        chat = {"id": chat_id, "type": chat_type}
+        if chat_type == "private":
+            chat["first_name"] = "User"
+        else:
+            chat["title"] = "Group"
+        return {"message_id": self._message_id, "date": int(time.time()), "chat": chat, **extra}
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+        if chat_id in self.blocked_chats:
+            return web.json_response({"ok": False, "error_code": 403, "description": BLOCKED_DESCRIPTION}, status=403)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "sendMediaGroup":
+            result = [self._message(chat_id) for _ in json.loads(params["media"])]
+        elif method in ("sendMessage", "sendPhoto", "sendDocument", "editMessageText"):
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "copyMessage":
+            result = {"message_id": self._message_id + 1}
+            self._message_id += 1
+        else:
+            # answerCallbackQuery, deleteMessages, setMyCommands, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
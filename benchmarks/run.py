@@ -0,0 +1,353 @@
+"""
+Offline benchmark: the real Dispatcher and routers against a local fake Bot API.
+
+    python -m benchmarks.run                      # all scenarios
+    python -m benchmarks.run browse broadcast     # some of them
+    python -m benchmarks.run --json after.json --compare before.json
+
+Scenarios: browse (/dzd -> date -> subject), homework (admin adds homework with
+attachments, then the notification is delivered), broadcast (one message to
+--chats chats) and reminder (the daily reminder to every chat).
+By default Telegram's rate limits are lifted so the numbers show the bot's own
+overhead; pass --throttled to keep them.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+ADMIN_ID = 1
+# Must be set before the bot's modules are imported: they read them at import time
+_workdir = tempfile.mkdtemp(prefix="bot-bench-")
+os.environ["DB_PATH"] = os.path.join(_workdir, "bench.db")
+os.environ["BOT_TOKEN"] = "123456:BENCHMARK"
+os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+os.environ.setdefault("SLOW_HANDLER_MS", "60000")
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+
+import main
+from benchmarks.fake_api import FakeBotAPI
+from keyboards.callbacks import DayDigest, HomeworkView, SubjectPick
+from keyboards.keyboards import get_next_school_days
+from middlewares.update_scheduler import update_scheduler
+from utils import broadcast as broadcast_module
+from utils.db_api import (
+    DAYS, pool, init_db, close_db, add_homework, update_schedule, get_day_subjects,
+    get_subject_ids, get_all_chats, get_unfinished_broadcast_jobs
+)
+from utils.outbox import enqueue_broadcast, start_outbox_worker, stop_outbox_worker
+
+SCENARIOS = ("browse", "digest", "inline", "homework", "broadcast", "reminder")
+LESSONS = ["Математика", "Русский язык", "Литература", "Физика", "История", "Английский язык", "Биология"]
+# Every N-th seeded chat has blocked the bot
+BLOCKED_EVERY = 50
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+class ApiRecorder(BaseRequestMiddleware):
+    """Bot API latencies as seen by the bot, per scenario"""
+
+    def __init__(self):
+        self.latencies = []
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+class UpdateFactory:
+    """Synthetic updates in Bot API JSON form, parsed exactly like webhook/polling input"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+        self.message_id = 0
+
+    def _next(self, **payload) -> Update:
+        self.update_id += 1
+        return Update.model_validate({"update_id": self.update_id, **payload}, context={"bot": self.bot})
+
+    def _message(self, user_id: int, **extra) -> dict:
+        self.message_id += 1
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "User"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            **extra,
+        }
+
+    def text(self, user_id: int, text: str) -> Update:
+        return self._next(message=self._message(user_id, text=text))
+
+    def photo(self, user_id: int, file_id: str) -> Update:
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+        return self._next(message=self._message(user_id, photo=photo))
+
+    def document(self, user_id: int, file_id: str) -> Update:
+        document = {"file_id": file_id, "file_unique_id": file_id, "file_name": "task.pdf"}
+        return self._next(message=self._message(user_id, document=document))
+
+    def inline_query(self, user_id: int, query: str) -> Update:
+        return self._next(inline_query={
+            "id": str(self.update_id), "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "query": query, "offset": "",
+        })
+
+    def callback(self, user_id: int, data: str) -> Update:
+        message = self._message(user_id, text="...")
+        message["from"] = {"id": 1, "is_bot": True, "first_name": "Bench"}
+        return self._next(callback_query={
+            "id": str(self.update_id), "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "chat_instance": str(user_id), "data": data, "message": message,
+        })
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeBotAPI(latency=args.api_latency / 1000)
+        self.recorder = ApiRecorder()
+        self.bot = None
+        self.dp = None
+        self.updates = None
+        self.latencies = []
+        self.seeded_chats = 0
+
+    async def setup(self):
+        await self.api.start()
+        await init_db()
+        self.bot = main.create_bot(session=AiohttpSession(api=TelegramAPIServer.from_base(self.api.base_url)))
+        self.bot.session.middleware(self.recorder)
+        self.dp = main.create_dispatcher()
+        self.updates = UpdateFactory(self.bot)
+        if not self.args.throttled:
+            broadcast_module.limiter.bucket = broadcast_module.TokenBucket(1e9)
+            broadcast_module.PRIVATE_CHAT_INTERVAL = 0
+            broadcast_module.GROUP_CHAT_INTERVAL = 0
+        start_outbox_worker(self.bot)
+        await self.seed()
+
+    async def teardown(self):
+        await stop_outbox_worker()
+        await self.dp.storage.close()
+        await self.bot.session.close()
+        await close_db()
+        await self.api.stop()
+
+    async def seed(self):
+        for i, day in enumerate(DAYS[:6]):
+            await update_schedule(day, [LESSONS[(i + j) % len(LESSONS)] for j in range(6)])
+        for hw_date in get_next_school_days():
+            for subject in (await get_day_subjects(hw_date))[:3]:
+                await add_homework(subject, None, hw_date, f"Упражнения на {hw_date:%d.%m}", [
+                    {"file_id": f"photo-{hw_date}-{subject}-1", "file_type": "photo"},
+                    {"file_id": f"photo-{hw_date}-{subject}-2", "file_type": "photo"},
+                    {"file_id": f"doc-{hw_date}-{subject}", "file_type": "document"},
+                ])
+        await self.add_chats(self.args.hw_chats)
+
+    async def add_chats(self, total: int):
+        """Grow the chat list to `total` chats: two thirds private, the rest groups."""
+        chat_ids = [i if i % 3 else -1000000000000 - i for i in range(1000 + self.seeded_chats, 1000 + total)]
+        self.seeded_chats = max(self.seeded_chats, total)
+        async with pool.write("bench_add_chats") as db:
+            await db.executemany("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", [(c,) for c in chat_ids])
+        self.api.blocked_chats.update(chat_ids[::BLOCKED_EVERY])
+
+    async def feed(self, update: Update):
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.latencies.append(time.perf_counter() - started)
+
+    async def drain_outbox(self):
+        while await get_unfinished_broadcast_jobs():
+            await asyncio.sleep(0.02)
+
+    # --- Scenarios ---
+
+    async def browse(self):
+        dates = get_next_school_days()
+        subject_ids = {}
+        for hw_date in dates:
+            subject_ids[hw_date] = list((await get_subject_ids(await get_day_subjects(hw_date))).values())
+        limit = asyncio.Semaphore(self.args.concurrency)
+
+        async def user_session(i: int):
+            user_id = 10_000_000 + i
+            hw_date = dates[i % len(dates)]
+            subject_id = subject_ids[hw_date][i % len(subject_ids[hw_date])]
+            async with limit:
+                await self.feed(self.updates.text(user_id, "/dzd"))
+                await self.feed(self.updates.callback(user_id, f"dzd_date_{hw_date.isoformat()}"))
+                await self.feed(self.updates.callback(user_id, HomeworkView(day=hw_date.isoformat(), subject_id=subject_id).pack()))
+
+        await asyncio.gather(*(user_session(i) for i in range(self.args.users)))
+
+    async def digest(self):
+        """browse, but each user opens the whole day instead of one subject"""
+        dates = get_next_school_days()
+        limit = asyncio.Semaphore(self.args.concurrency)
+
+        async def user_session(i: int):
+            user_id = 10_000_000 + i
+            hw_date = dates[i % len(dates)]
+            async with limit:
+                await self.feed(self.updates.text(user_id, "/dzd"))
+                await self.feed(self.updates.callback(user_id, f"dzd_date_{hw_date.isoformat()}"))
+                await self.feed(self.updates.callback(user_id, DayDigest(day=hw_date.isoformat()).pack()))
+
+        await asyncio.gather(*(user_session(i) for i in range(self.args.users)))
+
+    async def inline(self):
+        """The same lookups as browse, one inline query each instead of three updates"""
+        queries = ["", "завтра", "пт", LESSONS[0].lower(), f"завтра {LESSONS[1].lower()}"]
+        queries += [hw_date.strftime("%d.%m") for hw_date in get_next_school_days()]
+        limit = asyncio.Semaphore(self.args.concurrency)
+
+        async def user_query(i: int):
+            async with limit:
+                await self.feed(self.updates.inline_query(10_000_000 + i, queries[i % len(queries)]))
+
+        await asyncio.gather(*(user_query(i) for i in range(self.args.users)))
+
+    async def homework(self):
+        hw_date = get_next_school_days()[1]
+        subject = (await get_day_subjects(hw_date))[0]
+        subject_id = (await get_subject_ids([subject]))[subject]
+        for i in range(self.args.rounds):
+            for update in (
+                self.updates.text(ADMIN_ID, "➕ Добавить ДЗ"),
+                self.updates.callback(ADMIN_ID, f"add_hw_date_{hw_date.isoformat()}"),
+                self.updates.callback(ADMIN_ID, SubjectPick(subject_id=subject_id).pack()),
+                self.updates.text(ADMIN_ID, f"Задание {i}"),
+                self.updates.photo(ADMIN_ID, f"bench-photo-{i}-1"),
+                self.updates.photo(ADMIN_ID, f"bench-photo-{i}-2"),
+                self.updates.photo(ADMIN_ID, f"bench-photo-{i}-3"),
+                self.updates.document(ADMIN_ID, f"bench-doc-{i}-1"),
+                self.updates.document(ADMIN_ID, f"bench-doc-{i}-2"),
+                self.updates.text(ADMIN_ID, "/done"),
+            ):
+                await self.feed(update)
+        await self.drain_outbox()
+
+    async def broadcast(self):
+        await self.add_chats(self.args.chats)
+        chats = await get_all_chats()
+        await enqueue_broadcast("Бенчмарк", [{"method": "send_message", "text": "Проверка рассылки"}], chats)
+        await self.drain_outbox()
+
+    async def reminder(self):
+        tomorrow = date.today() + timedelta(days=1)
+        await add_homework(LESSONS[0], None, tomorrow, "Повторить параграф", [])
+        # Every seeded chat has the default reminder time
+        await main.send_reminders(self.bot, now=datetime.combine(date.today(), dt_time(15, 0)), spread=0)
+        await self.drain_outbox()
+
+    async def run(self, name: str) -> dict:
+        self.latencies = []
+        self.recorder.latencies = []
+        self.api.reset()
+        shed = update_scheduler.shed
+        started = time.perf_counter()
+        await getattr(self, name)()
+        elapsed = time.perf_counter() - started
+        calls = sum(self.api.calls.values())
+        return {
+            "scenario": name,
+            "updates": len(self.latencies),
+            "elapsed": elapsed,
+            "updates_per_sec": len(self.latencies) / elapsed,
+            "p50_ms": percentile(self.latencies, 0.5) * 1000,
+            "p99_ms": percentile(self.latencies, 0.99) * 1000,
+            "api_calls": calls,
+            "api_per_sec": calls / elapsed,
+            "api_p50_ms": percentile(self.recorder.latencies, 0.5) * 1000,
+            "api_p99_ms": percentile(self.recorder.latencies, 0.99) * 1000,
+            "api_methods": dict(self.api.calls.most_common()),
+            "shed": update_scheduler.shed - shed,
+        }
+
+
+def print_report(results, baseline=None):
+    baseline = {r["scenario"]: r for r in baseline or []}
+    print(f"\n{'scenario':<10} {'updates':>7} {'upd/s':>8} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'api calls':>9} {'api/s':>8} {'api p99':>7} {'elapsed':>8}")
+    for r in results:
+        print(f"{r['scenario']:<10} {r['updates']:>7} {r['updates_per_sec']:>8.1f} {r['p50_ms']:>7.2f} {r['p99_ms']:>7.2f} "
+              f"{r['api_calls']:>9} {r['api_per_sec']:>8.1f} {r['api_p99_ms']:>7.2f} {r['elapsed']:>7.2f}s")
+        before = baseline.get(r["scenario"])
+        if before:
+            print(f"{'':<10} vs baseline: elapsed {_delta(r['elapsed'], before['elapsed'])}, "
+                  f"p99 {_delta(r['p99_ms'], before['p99_ms'])}, api calls {_delta(r['api_calls'], before['api_calls'])}")
+    for r in results:
+        methods = ", ".join(f"{method} {count}" for method, count in r["api_methods"].items())
+        print(f"  {r['scenario']}: {methods}" + (f" (shed {r['shed']} updates)" if r["shed"] else ""))
+
+
+def _delta(after: float, before: float) -> str:
+    return f"{(after - before) / before:+.1%}" if before else "n/a"
+
+
+async def run(args):
+    bench = Bench(args)
+    await bench.setup()
+    try:
+        return [await bench.run(name) for name in args.scenarios or SCENARIOS]
+    finally:
+        await bench.teardown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark against a fake Bot API")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--users", type=int, default=1000, help="browse: simulated users (3 updates each)")
+    parser.add_argument("--concurrency", type=int, default=100, help="browse: users active at once")
+    parser.add_argument("--rounds", type=int, default=20, help="homework: homework entries added")
+    parser.add_argument("--hw-chats", type=int, default=100, help="homework: chats notified of each entry")
+    parser.add_argument("--chats", type=int, default=10000, help="broadcast/reminder: chats to deliver to")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API latency, ms")
+    parser.add_argument("--throttled", action="store_true", help="keep Telegram rate limits (slow)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results written earlier with --json")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, force=True)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(_workdir, ignore_errors=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
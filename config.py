@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,3 +8,25 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(x.strip()) for x in os.getenv("ADMIN_IDS", "0").split(",") if x.strip()]
 print(f"DEBUG: Loaded ADMIN_IDS from .env: {ADMIN_IDS}")
 
+
+# Webhook mode: set WEBHOOK_URL (e.g. https://your-app.onrender.com) to receive updates
+# on the keep-alive web server instead of long polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Telegram sends it back in X-Telegram-Bot-Api-Secret-Token; random per process if not set
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+# Update processing limits (see middlewares/update_scheduler.py)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32))
+UPDATE_CHAT_QUEUE = int(os.getenv("UPDATE_CHAT_QUEUE", 20))
+UPDATE_MAX_WAITING = int(os.getenv("UPDATE_MAX_WAITING", 1000))
+
+# Updates slower than this (milliseconds) are logged with their handler (see middlewares/profiling.py)
+SLOW_HANDLER_MS = int(os.getenv("SLOW_HANDLER_MS", 500))
+
+# Nightly maintenance (see utils/maintenance.py): homework older than this many days
+# is moved to the archive tables ("archive") or dropped ("delete"); 0 keeps everything
+HW_RETENTION_DAYS = int(os.getenv("HW_RETENTION_DAYS", 180))
+HW_RETENTION_MODE = os.getenv("HW_RETENTION_MODE", "archive")
+# Finished broadcasts (and their per-chat delivery rows) are dropped after this many days; 0 keeps them
+BROADCAST_RETENTION_DAYS = int(os.getenv("BROADCAST_RETENTION_DAYS", 14))
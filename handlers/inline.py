@@ -0,0 +1,44 @@
+from aiogram import Router, types
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+
+from utils.db_api import DAYS, get_chat_grade
+from utils.hw_index import homework_index
+from utils.media import MESSAGE_LIMIT
+
+router = Router(name="inline")
+
+# Telegram answers repeats of the same query from its own cache for this long (seconds).
+# Results depend on the user's class, so the cache is per user (is_personal).
+INLINE_CACHE_TIME = 120
+
+
+def render_inline_homework(hw_date, subject: str, items: list) -> str:
+    # Plain text: descriptions are free-form and would break Markdown parsing of the whole answer
+    lines = [f"📌 {subject} — {hw_date.strftime('%d.%m.%Y')} ({DAYS[hw_date.weekday()]})"]
+    for item in items:
+        # Homework sent as a bare photo has no text
+        lines.append(f"📝 {item['description'] or 'без текста'}")
+    files = sum(len(item['attachments']) for item in items)
+    if files:
+        lines.append(f"📎 Вложений: {files} — откройте /dzd в боте")
+    # One over-long article makes Telegram reject the whole answer
+    text = "\n".join(lines)
+    return text if len(text) <= MESSAGE_LIMIT else text[:MESSAGE_LIMIT - 1] + "…"
+
+
+@router.inline_query()
+async def inline_homework(inline_query: types.InlineQuery):
+    # No chat here; the user's class is the one chosen in the private chat with the bot
+    grade = await get_chat_grade(inline_query.from_user.id)
+    found = await homework_index.search(inline_query.query, grade)
+
+    results = []
+    for hw_date, subject, items in found:
+        text = render_inline_homework(hw_date, subject, items)
+        results.append(InlineQueryResultArticle(
+            id=f"{hw_date.isoformat()}:{items[0]['id']}",
+            title=f"{subject} — {hw_date.strftime('%d.%m')} ({DAYS[hw_date.weekday()]})",
+            description=(items[0]['description'] or '')[:100],
+            input_message_content=InputTextMessageContent(message_text=text),
+        ))
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
@@ -1,13 +1,19 @@
 from aiogram import Router, F, types
-from aiogram.filters import Command
-from utils.db_api import get_homework, get_schedule, add_chat
-from keyboards.keyboards import get_user_main_kb
-from datetime import datetime, timedelta
+from aiogram.filters import Command, CommandObject
+from config import ADMIN_IDS
+from utils.db_api import (
+    get_homework, get_schedule, add_chat, deactivate_chats, migrate_chat,
+    get_chat_grade, set_chat_grade, get_grades, normalize_grade,
+    get_chat_reminder, set_chat_reminder, normalize_remind_at
+)
+from keyboards.keyboards import get_user_main_kb, get_grades_kb
+from keyboards.callbacks import ClassSubscribe
+from datetime import date, datetime, timedelta
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from utils.cleaner import schedule_deletion
 
-router = Router()
+router = Router(name="user")
 
 class UserStates(StatesGroup):
     waiting_for_hw_date = State()
@@ -44,47 +50,170 @@ async def cmd_help(message: types.Message):
         "Доступные команды:\n"
         "/dzd - Выбрать дату для ДЗ\n"
         "/raspisanie - Расписание на сегодня\n"
+        "/class - Выбрать класс\n"
+        "/remind 18:30 - Время напоминаний (/remind off - отключить)\n"
+        "/find слово - Поиск по всем ДЗ\n"
         "Также используйте кнопки меню."
     )
     msg = await message.answer(text)
     schedule_deletion(msg)
 
+# --- Class subscription ---
+async def can_change_settings(bot, chat: types.Chat, user_id: int) -> bool:
+    """Anyone in a private chat; in groups only the group's admins (or the bot's)."""
+    if chat.type == "private" or user_id in ADMIN_IDS:
+        return True
+    member = await bot.get_chat_member(chat.id, user_id)
+    return member.status in ("creator", "administrator")
+
+def class_status(grade) -> str:
+    if grade:
+        return f"🏫 Класс: {grade}. Приходят задания и расписание этого класса."
+    return "🏫 Класс не выбран: приходят задания всех классов."
+
+@router.message(Command("class"))
+async def cmd_class(message: types.Message, command: CommandObject):
+    if command.args:
+        if not await can_change_settings(message.bot, message.chat, message.from_user.id):
+            msg = await message.answer("Настройки группы может поменять только администратор чата.")
+            schedule_deletion(msg)
+            return
+        arg = command.args.strip()
+        if arg.lower() in ("все", "off", "-"):
+            grade = None
+        else:
+            grade = normalize_grade(arg)
+            if grade is None:
+                msg = await message.answer("Не похоже на класс. Пример: /class 7Б (или /class все).")
+                schedule_deletion(msg)
+                return
+        await set_chat_grade(message.chat.id, grade)
+        msg = await message.answer(class_status(grade))
+        schedule_deletion(msg)
+        return
+
+    grades = await get_grades()
+    text = class_status(await get_chat_grade(message.chat.id)) + "\n\nВыберите класс или отправьте /class 7Б."
+    kb = get_grades_kb(grades, ClassSubscribe, cancel=False) if grades else None
+    msg = await message.answer(text, reply_markup=kb)
+    schedule_deletion(msg, delay=60)
+
+@router.callback_query(ClassSubscribe.filter())
+async def process_class_callback(callback: types.CallbackQuery, callback_data: ClassSubscribe):
+    if not await can_change_settings(callback.bot, callback.message.chat, callback.from_user.id):
+        await callback.answer("Класс группы может поменять только администратор чата.", show_alert=True)
+        return
+    grade = callback_data.grade or None
+    await set_chat_grade(callback.message.chat.id, grade)
+    await callback.message.edit_text(class_status(grade))
+    await callback.answer()
+
+# --- Reminder time ---
+def reminder_status(remind_at) -> str:
+    if remind_at:
+        return f"🔔 Напоминания о ДЗ на завтра приходят в {remind_at}."
+    return "🔕 Напоминания отключены."
+
+@router.message(Command("remind"))
+async def cmd_remind(message: types.Message, command: CommandObject):
+    if not command.args:
+        msg = await message.answer(
+            reminder_status(await get_chat_reminder(message.chat.id))
+            + "\n\nИзменить: /remind 18:30, отключить: /remind off."
+        )
+        schedule_deletion(msg)
+        return
+    if not await can_change_settings(message.bot, message.chat, message.from_user.id):
+        msg = await message.answer("Настройки группы может поменять только администратор чата.")
+        schedule_deletion(msg)
+        return
+
+    arg = command.args.strip()
+    if arg.lower() in ("off", "выкл", "нет", "-"):
+        remind_at = None
+    else:
+        remind_at = normalize_remind_at(arg)
+        if remind_at is None:
+            msg = await message.answer("Укажите время в формате ЧЧ:ММ, например /remind 18:30.")
+            schedule_deletion(msg)
+            return
+    await set_chat_reminder(message.chat.id, remind_at)
+    msg = await message.answer(reminder_status(remind_at))
+    schedule_deletion(msg)
+
+# --- Search ---
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from utils.db_api import search_homework, fts_query
+from keyboards.callbacks import FindPage
+
+FIND_PAGE_SIZE = 10
+
+async def render_search_page(query: str, grade, after=None):
+    """Text and "next page" keyboard for one page of /find results"""
+    items, cursor = await search_homework(query, FIND_PAGE_SIZE, after, grade)
+    if not items:
+        return (f"🔎 По запросу «{query}» больше ничего не найдено." if after else
+                f"🔎 По запросу «{query}» ничего не найдено."), None
+
+    # Plain text: snippets are free-form homework text
+    lines = [f"🔎 Найдено по запросу «{query}»:"]
+    for item in items:
+        grade_note = f" [{item['grade']}]" if item['grade'] else ""
+        lines.append(f"\n📅 {item['hw_date'].strftime('%d.%m.%Y')} · {item['subject']}{grade_note}\n{item['snippet']}")
+    kb = None
+    if cursor:
+        builder = InlineKeyboardBuilder()
+        builder.button(text="Ещё ▶", callback_data=FindPage(rank=cursor[0], hw_id=cursor[1]))
+        kb = builder.as_markup()
+    return "\n".join(lines), kb
+
+@router.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject, state: FSMContext):
+    query = (command.args or "").strip()
+    if not fts_query(query):
+        msg = await message.answer("Укажите, что искать, например: /find уравнения")
+        schedule_deletion(msg)
+        return
+    # Callback data is limited to 64 bytes, so the query waits in FSM data for "next page"
+    await state.update_data(find_query=query)
+    text, kb = await render_search_page(query, await get_chat_grade(message.chat.id))
+    msg = await message.answer(text, reply_markup=kb)
+    schedule_deletion(msg, delay=120)
+
+@router.callback_query(FindPage.filter())
+async def process_find_page(callback: types.CallbackQuery, callback_data: FindPage, state: FSMContext):
+    query = (await state.get_data()).get('find_query')
+    if not query:
+        await callback.answer("Поиск устарел, повторите /find.", show_alert=True)
+        return
+    grade = await get_chat_grade(callback.message.chat.id)
+    text, kb = await render_search_page(query, grade, (callback_data.rank, callback_data.hw_id))
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
 from keyboards.user_kb import get_subjects_kb
-from utils.db_api import get_homework_subjects, get_homework_by_subject
+from utils.db_api import get_day_subjects, get_homework_by_subject, get_subject_ids, get_subject_name
+from keyboards.callbacks import HomeworkView
 
 async def show_hw_dates(message: types.Message, date_obj):
-    from utils.db_api import get_schedule_subjects
-    subjects = await get_schedule_subjects(date_obj)
-    
-    if not subjects:
-        # Fallback: if no schedule, maybe check if there is HW anyway? 
-        # But user wants schedule-based. Let's stick to schedule.
-        # Or maybe combine?
-        # Let's check actual HW too if schedule is missing (e.g. extra classes)
-        existing_hw_subjects = await get_homework_subjects(date_obj)
-        # Use dict.fromkeys to preserve order of 'subjects' (schedule) and append new ones from 'existing'
-        combined = list(subjects)
-        for s in existing_hw_subjects:
-            if s not in combined:
-                combined.append(s)
-        subjects = combined
+    # Schedule subjects plus any extra subjects with HW (e.g. extra classes), one query
+    subjects = await get_day_subjects(date_obj, await get_chat_grade(message.chat.id))
     
     if not subjects:
         msg = await message.answer(f"На {date_obj.strftime('%d.%m.%Y')} расписания нет и предмета с ДЗ не найдено.")
         schedule_deletion(msg)
         return
 
-    kb = get_subjects_kb(subjects, date_obj)
+    kb = get_subjects_kb(await get_subject_ids(subjects), date_obj)
     msg = await message.answer(f"📚 **ДЗ на {date_obj.strftime('%d.%m.%Y')}**\nВыберите предмет:", reply_markup=kb, parse_mode="Markdown")
     schedule_deletion(msg)
 
-@router.callback_query(F.data.startswith("hw_"))
-async def show_hw_content(callback: types.CallbackQuery):
-    # Data format: hw_2023-10-25_SubjectName
-    _, date_str, subject = callback.data.split("_", 2)
-    hw_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+@router.callback_query(HomeworkView.filter())
+async def show_hw_content(callback: types.CallbackQuery, callback_data: HomeworkView):
+    hw_date = date.fromisoformat(callback_data.day)
+    subject = await get_subject_name(callback_data.subject_id)
     
-    hw_list = await get_homework_by_subject(hw_date, subject)
+    hw_list = await get_homework_by_subject(hw_date, subject, await get_chat_grade(callback.message.chat.id))
     
     if not hw_list:
         msg = await callback.message.answer(f"📌 *{subject}*\nНа этот предмет пока не добавлено домашнее задание.", parse_mode="Markdown")
@@ -122,6 +251,40 @@ async def show_hw_content(callback: types.CallbackQuery):
                  
     await callback.answer()
 
+from keyboards.callbacks import DayDigest
+from utils.media import media_payload, pack_text
+from utils.outbox import build_steps
+
+@router.callback_query(DayDigest.filter())
+async def show_day_digest(callback: types.CallbackQuery, callback_data: DayDigest):
+    """Every subject's homework for a date: text in one message, attachments in as few albums as possible"""
+    hw_date = date.fromisoformat(callback_data.day)
+    grade = await get_chat_grade(callback.message.chat.id)
+    # One query for all subjects with their attachments
+    homework = await get_homework(hw_date, grade)
+    if not homework:
+        await callback.answer("На эту дату заданий пока нет.", show_alert=True)
+        return
+
+    # Timetable order (cached), extra subjects after it
+    order = await get_day_subjects(hw_date, grade)
+    subjects = sorted(homework, key=lambda s: order.index(s) if s in order else len(order))
+    blocks = [f"📚 ДЗ на {hw_date.strftime('%d.%m.%Y')}"]
+    attachments = []
+    for subject in subjects:
+        blocks.append(f"📌 {subject}\n" + "\n".join(f"📝 {item['description'] or 'без текста'}" for item in homework[subject]))
+        attachments += [att for item in homework[subject] for att in item['attachments']]
+
+    # Plain text: one stray Markdown character in any description would reject the whole digest
+    *first, last = pack_text(blocks)
+    payload = [{'method': 'send_message', 'text': text, 'parse_mode': None} for text in first]
+    payload += media_payload(last, attachments, parse_mode=None)
+    for step in build_steps(callback.bot, payload):
+        sent = await step(callback.message.chat.id)
+        for msg in sent if isinstance(sent, list) else [sent]:
+            schedule_deletion(msg, delay=120)
+    await callback.answer()
+
 @router.message(F.text == "🔎 ДЗ по дате")
 @router.message(Command("dzd")) 
 async def show_10_days_menu(message: types.Message):
@@ -142,21 +305,14 @@ async def process_dzd_date(callback: types.CallbackQuery):
     # It calls get_subjects_kb and sends message. 
     # To keep it clean in groups/inline, maybe we edit the message?
     
-    from utils.db_api import get_schedule_subjects
-    subjects = await get_schedule_subjects(hw_date)
-    # Combine with existing HW subjects preserving order
-    existing_hw_subjects = await get_homework_subjects(hw_date)
-    combined = list(subjects)
-    for s in existing_hw_subjects:
-        if s not in combined:
-            combined.append(s)
-    subjects = combined
+    # Schedule subjects combined with existing HW subjects, preserving order
+    subjects = await get_day_subjects(hw_date, await get_chat_grade(callback.message.chat.id))
     
     if not subjects:
         await callback.message.edit_text(f"На {hw_date.strftime('%d.%m.%Y')} расписания нет.")
         return
 
-    kb = get_subjects_kb(subjects, hw_date)
+    kb = get_subjects_kb(await get_subject_ids(subjects), hw_date)
     await callback.message.edit_text(f"📚 **ДЗ на {hw_date.strftime('%d.%m.%Y')}**\nВыберите предмет:", reply_markup=kb, parse_mode="Markdown")
     await callback.answer()
 
@@ -165,8 +321,7 @@ async def process_dzd_date(callback: types.CallbackQuery):
 
 
 
-from keyboards.keyboards import get_week_days_kb
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from keyboards.keyboards import get_schedule_days_kb
 
 @router.message(Command("raspisanie"))
 @router.message(Command("rs"))
@@ -174,16 +329,13 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 @router.message(F.text == "📚 Расписание на неделю")
 async def cmd_schedule(message: types.Message):
     # Show inline keyboard with days
-    days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
-    buttons = [[InlineKeyboardButton(text=day, callback_data=f"view_sched_{day}")] for day in days]
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
-    msg = await message.answer("Выберите день недели для просмотра расписания:", reply_markup=kb)
+    msg = await message.answer("Выберите день недели для просмотра расписания:", reply_markup=get_schedule_days_kb())
     schedule_deletion(msg)
 
 @router.callback_query(F.data.startswith("view_sched_"))
 async def process_view_sched(callback: types.CallbackQuery):
     day = callback.data.split("_")[2]
-    lessons = await get_schedule(day)
+    lessons = await get_schedule(day, await get_chat_grade(callback.message.chat.id))
     
     if lessons:
         msg = await callback.message.answer(f"📅 **Расписание на {day}:**\n\n{lessons}", parse_mode="Markdown")
@@ -195,9 +347,18 @@ async def process_view_sched(callback: types.CallbackQuery):
 # --- Auto-register chats ---
 @router.my_chat_member()
 async def on_bot_added(event: types.ChatMemberUpdated):
+    status = event.new_chat_member.status
     # If bot is added to group or user unblocked bot
-    if event.new_chat_member.status in ['member', 'administrator']:
+    if status in ['member', 'administrator']:
         await add_chat(event.chat.id)
+    # Bot was removed from the group or the user blocked it: stop sending there
+    elif status in ['kicked', 'left']:
+        await deactivate_chats([(event.chat.id, status)])
+
+@router.message(F.migrate_to_chat_id)
+async def on_chat_migrated(message: types.Message):
+    # Group upgraded to a supergroup, which has a new chat ID
+    await migrate_chat(message.chat.id, message.migrate_to_chat_id)
 
 @router.message(F.new_chat_members)
 async def on_new_member(message: types.Message):
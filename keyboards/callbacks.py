@@ -0,0 +1,48 @@
+from aiogram.filters.callback_data import CallbackData
+
+# Typed callback payloads. Subjects and homework are referenced by integer ID,
+# so payloads stay far below Telegram's 64-byte limit whatever the subject name.
+# Dates are ISO strings ("2024-10-25").
+
+
+class HomeworkView(CallbackData, prefix="hw"):
+    """User picks a subject to see its homework for a date"""
+    day: str
+    subject_id: int
+
+
+class DayDigest(CallbackData, prefix="hw_day"):
+    """User asks for the homework of every subject of a date at once"""
+    day: str
+
+
+class SubjectPick(CallbackData, prefix="sel_subj"):
+    """Admin picks a subject from the schedule when adding homework"""
+    subject_id: int
+
+
+class SubjectDelete(CallbackData, prefix="del_subj"):
+    """Admin deletes all homework of a subject for a date"""
+    day: str
+    subject_id: int
+
+
+class HomeworkDelete(CallbackData, prefix="del_hw"):
+    """Admin deletes one homework row"""
+    hw_id: int
+
+
+class GradePick(CallbackData, prefix="grade"):
+    """Admin picks the class a homework, timetable or announcement is for ("" = all classes)"""
+    grade: str
+
+
+class ClassSubscribe(CallbackData, prefix="class"):
+    """Chat subscribes to a class ("" = all classes)"""
+    grade: str
+
+
+class FindPage(CallbackData, prefix="find"):
+    """Next page of /find results: keyset cursor (rank, id) of the last shown row"""
+    rank: float
+    hw_id: int
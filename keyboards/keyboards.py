@@ -1,6 +1,11 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta
+from functools import lru_cache
 
+# Static keyboards are built once and reused: aiogram only serializes them.
+
+@lru_cache(maxsize=None)
 def get_user_main_kb():
     kp = ReplyKeyboardMarkup(
         keyboard=[
@@ -11,20 +16,23 @@ def get_user_main_kb():
     )
     return kp
 
+@lru_cache(maxsize=None)
 def get_admin_panel_kb():
     kp = ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="➕ Добавить ДЗ"), KeyboardButton(text="🗑 Удалить ДЗ")],
             [KeyboardButton(text="✏ Редактировать расписание"), KeyboardButton(text="📢 Объявление")],
-            [KeyboardButton(text="⬅ Назад")]
+            [KeyboardButton(text="📊 Рассылки"), KeyboardButton(text="⬅ Назад")]
         ],
         resize_keyboard=True
     )
     return kp
 
+@lru_cache(maxsize=None)
 def get_cancel_kb():
     return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="❌ Отмена")]], resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_week_days_kb():
     # Only Monday-Saturday
     days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
@@ -32,6 +40,7 @@ def get_week_days_kb():
     buttons.append([KeyboardButton(text="❌ Отмена")])
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_days_kb():
     """Inline keyboard for days of week"""
     days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
@@ -39,26 +48,57 @@ def get_days_kb():
     buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_action")])
     return InlineKeyboardMarkup(inline_keyboard=buttons) 
 
+def get_next_school_days(count: int = 10, today=None):
+    """Next `count` dates starting today, skipping Sundays."""
+    today = today or datetime.now().date()
+    dates = []
+    i = 0
+    while len(dates) < count:
+        date_opt = today + timedelta(days=i)
+        if date_opt.weekday() != 6: # Skip Sunday (6)
+            dates.append(date_opt)
+        i += 1
+    return dates
+
 def get_next_days_kb(callback_prefix: str = "date_"):
     """
     Generates inline keyboard with next 10 days, skipping Sundays.
     callback_prefix: prefix for callback_data (e.g. 'hw_view_', 'hw_add_', 'hw_del_')
     """
-    today = datetime.now().date()
+    # Keyed by today's date, so the cached keyboard rolls over at local midnight
+    return _next_days_kb(callback_prefix, datetime.now().date())
+
+@lru_cache(maxsize=16)
+def _next_days_kb(callback_prefix: str, today):
     days_reverse = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
     
     rows = []
-    count = 0
-    i = 0
-    while count < 10:
-        date_opt = today + timedelta(days=i)
-        weekday = date_opt.weekday()
-        if weekday != 6: # Skip Sunday (6)
-            day_name = days_reverse[weekday]
-            btn_text = f"{date_opt.strftime('%d.%m.%Y')} ({day_name})"
-            rows.append([InlineKeyboardButton(text=btn_text, callback_data=f"{callback_prefix}{date_opt.isoformat()}")])
-            count += 1
-        i += 1
+    for date_opt in get_next_school_days(today=today):
+        day_name = days_reverse[date_opt.weekday()]
+        btn_text = f"{date_opt.strftime('%d.%m.%Y')} ({day_name})"
+        rows.append([InlineKeyboardButton(text=btn_text, callback_data=f"{callback_prefix}{date_opt.isoformat()}")])
         
     rows.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_action")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@lru_cache(maxsize=None)
+def get_schedule_days_kb():
+    """Inline keyboard for viewing the schedule of a weekday"""
+    days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
+    buttons = [[InlineKeyboardButton(text=day, callback_data=f"view_sched_{day}")] for day in days]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def get_grades_kb(grades, callback_factory, cancel: bool = True):
+    """Inline keyboard of classes plus "all classes"; callback_factory is GradePick or ClassSubscribe"""
+    return _grades_kb(tuple(grades), callback_factory, cancel)
+
+@lru_cache(maxsize=32)
+def _grades_kb(grades: tuple, callback_factory, cancel: bool):
+    builder = InlineKeyboardBuilder()
+    for grade in grades:
+        builder.button(text=grade, callback_data=callback_factory(grade=grade))
+    builder.adjust(4)
+    builder.row(InlineKeyboardButton(text="🏫 Все классы", callback_data=callback_factory(grade="").pack()))
+    if cancel:
+        builder.row(InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_action"))
+    return builder.as_markup()
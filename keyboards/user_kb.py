@@ -1,13 +1,29 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import date
+from functools import lru_cache
+from keyboards.callbacks import HomeworkView, DayDigest
+from utils.db_api import cache
 
-def get_subjects_kb(subjects, hw_date: date):
+def get_subjects_kb(subject_ids: dict, hw_date: date):
+    """subject_ids: {subject name: subject id}, in display order"""
+    return _subjects_kb(hw_date, tuple(subject_ids.items()))
+
+# Keyed by date and subject set; dropped whenever the day's subjects are invalidated
+@lru_cache(maxsize=256)
+def _subjects_kb(hw_date: date, subject_ids: tuple):
     builder = InlineKeyboardBuilder()
-    date_str = hw_date.strftime("%Y-%m-%d") # Store date in callback to persist state
+    date_str = hw_date.isoformat() # Store date in callback to persist state
     
-    for subject in subjects:
-        builder.button(text=subject, callback_data=f"hw_{date_str}_{subject}")
+    builder.button(text="📖 Весь день", callback_data=DayDigest(day=date_str))
+    for subject, subject_id in subject_ids:
+        builder.button(text=subject, callback_data=HomeworkView(day=date_str, subject_id=subject_id))
     
     builder.adjust(1) # 1 column
     return builder.as_markup()
+
+def _on_invalidate(namespace=None, *prefix):
+    if namespace in (None, "day_subjects"):
+        _subjects_kb.cache_clear()
+
+cache.add_listener(_on_invalidate)
@@ -1,94 +1,219 @@
 import asyncio
 import logging
 import os
+import signal
+from contextlib import suppress
 from aiohttp import web
 from aiogram import Bot, Dispatcher
-from config import BOT_TOKEN
-from handlers import admin, user
-from utils.db_api import init_db, get_all_chats, get_homework
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+from handlers import admin, user, inline
+from utils.db_api import init_db, close_db, ping_db, get_homework
+from utils.outbox import enqueue_broadcast, start_outbox_worker, stop_outbox_worker
+from utils.maintenance import run_maintenance
+from utils.cleaner import scheduler as deletion_scheduler
+from utils.fsm_storage import SQLiteStorage
+from middlewares.update_scheduler import update_scheduler
+from middlewares.api_metrics import ApiMetricsMiddleware
+from middlewares.profiling import profiler
+from utils import metrics
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 from datetime import datetime, timedelta
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 
-async def daily_reminder(bot: Bot):
-    """Check for tomorrow's HW and send reminder"""
-    tomorrow = datetime.now().date() + timedelta(days=1)
-    # We just check if there are subjects
-    from utils.db_api import get_homework_subjects
-    subjects = await get_homework_subjects(tomorrow)
-    
-    if not subjects:
-        return # No HW tomorrow, no alarm
-        
-    chats = await get_all_chats()
-    msg_text = f"🔔 **Напоминание!**\nНе забудьте сделать ДЗ на завтра ({tomorrow.strftime('%d.%m.%Y')}).\nВведите /dz завтра, чтобы посмотреть."
+# Reminders due in a minute are spread over this many seconds of it
+REMINDER_SPREAD = 50
+
+async def send_reminders(bot: Bot, now: datetime = None, spread: float = REMINDER_SPREAD):
+    """Runs every minute: remind the chats whose reminder time is now about tomorrow's HW"""
+    from utils.db_api import get_reminder_chats, get_homework_subjects
+    now = now or datetime.now()
+    chats_by_grade = await get_reminder_chats(now.strftime("%H:%M"))
+    if not chats_by_grade:
+        return
     
-    for chat_id in chats:
-        try:
-            await bot.send_message(chat_id, msg_text, parse_mode="Markdown")
-        except Exception:
-            pass
+    tomorrow = now.date() + timedelta(days=1)
+    for grade, chats in chats_by_grade.items():
+        # Cached per date and class, so this is one query per class per day, not per chat
+        subjects = await get_homework_subjects(tomorrow, grade)
+        if not subjects:
+            continue # No HW tomorrow, no alarm
+        msg_text = (
+            # Plain text: subject names are free-form and would break Markdown parsing for the whole class
+            f"🔔 Напоминание!\nДЗ на завтра ({tomorrow.strftime('%d.%m.%Y')}):\n"
+            + "\n".join(f"• {subject}" for subject in subjects)
+            + "\n\nПосмотреть задания: /dzd"
+        )
+        await enqueue_broadcast(
+            "Напоминание", [{'method': 'send_message', 'text': msg_text}], chats, spread=spread
+        )
 
 # --- Keep-alive web server for Render ---
+# /healthz fails when the loop is this late (seconds) or the DB doesn't answer in time
+HEALTH_MAX_LOOP_LAG = 1.0
+HEALTH_DB_TIMEOUT = 2.0
+
 async def handle(request):
     return web.Response(text="Bot is running!")
 
-async def run_web_server():
+async def handle_metrics(request):
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def handle_healthz(request):
+    lag = metrics.loop_lag()
+    try:
+        await asyncio.wait_for(ping_db(), HEALTH_DB_TIMEOUT)
+        db = "ok"
+    except Exception as e:
+        db = f"error: {e!r}"
+    healthy = db == "ok" and lag < HEALTH_MAX_LOOP_LAG
+    return web.json_response(
+        {"status": "ok" if healthy else "unhealthy", "db": db, "event_loop_lag": round(lag, 4)},
+        status=200 if healthy else 503
+    )
+
+def on_job_event(event):
+    if event.code == EVENT_JOB_SUBMITTED:
+        now = datetime.now().astimezone()
+        for run_time in event.scheduled_run_times:
+            metrics.JOB_LAG.observe((now - run_time).total_seconds())
+    else:
+        metrics.JOB_ERRORS.inc(job=event.job_id, reason="error" if event.code == EVENT_JOB_ERROR else "missed")
+
+def create_web_app(dp: Dispatcher, bot: Bot):
     app = web.Application()
     app.router.add_get("/", handle)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/healthz", handle_healthz)
+    if WEBHOOK_URL:
+        # Telegram pushes updates here; requests without our secret token are rejected
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    return app
+
+async def run_web_server(app: web.Application):
     port = int(os.environ.get("PORT", 10000))
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
     print(f"Web server started on port {port}")
+    return runner
 
-async def main():
-    # Initialize DB
-    await init_db()
+def create_bot(**kwargs) -> Bot:
+    bot = Bot(token=BOT_TOKEN, **kwargs)
+    # Count and time every Bot API call
+    bot.session.middleware(ApiMetricsMiddleware())
+    return bot
 
-    # Start web server (for Render keep-alive)
-    await run_web_server()
+def create_dispatcher() -> Dispatcher:
+    # FSM state lives in SQLite so admin flows survive restarts
+    dp = Dispatcher(storage=SQLiteStorage())
     
-    # Initialize Bot and Dispatcher
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+    # Bounded concurrency, per-chat ordering and load shedding in front of all routers
+    dp.update.outer_middleware(update_scheduler)
+    # Per-handler timings, slow update log and on-demand profiling (/profile)
+    profiler.setup(dp)
     
     # Register routers
     dp.include_router(admin.router)
     dp.include_router(user.router)
+    dp.include_router(inline.router)
+    return dp
+
+async def main():
+    # Initialize Bot and Dispatcher
+    bot = create_bot()
+    dp = create_dispatcher()
     
     # Setup Scheduler
     scheduler = AsyncIOScheduler()
-    # Schedule reminder every day at 15:00 (can be changed)
-    scheduler.add_job(daily_reminder, 'cron', hour=15, minute=0, args=[bot])
-    scheduler.start()
-    
-    # Set Bot Description and Commands
-    await bot.set_my_description(
-        "📅 Школьный бот-помощник.\n\n"
-        "✅ Домашнее задание на 10 дней вперед\n"
-        "✅ Расписание уроков\n"
-        "✅ Уведомления о новых заданиях\n\n"
-        "Нажми /start, чтобы начать пользоваться!"
+    # Reminders are checked every minute; each chat picks its time with /remind
+    scheduler.add_job(
+        send_reminders, 'cron', second=0, args=[bot], id="reminders", coalesce=True, misfire_grace_time=30
     )
-    await bot.set_my_short_description("ДЗ, Расписание, Уведомления")
-    
-    from aiogram.types import BotCommand
-    commands = [
-        BotCommand(command="start", description="Запустить бота"),
-        BotCommand(command="dzd", description="Найти ДЗ (10 дней)"),
-        BotCommand(command="raspisanie", description="Расписание"),
-        BotCommand(command="help", description="Помощь"),
-        BotCommand(command="cancel", description="Отмена действия")
-    ]
-    await bot.set_my_commands(commands)
+    # Old homework to the archive, freed pages back to the filesystem, at night when nobody is reading
+    scheduler.add_job(
+        run_maintenance, 'cron', hour=3, minute=30, id="maintenance", coalesce=True, misfire_grace_time=3600
+    )
+    scheduler.add_listener(on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
     
-    # Start polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    runner = None
+    # The DB connections run in non-daemon threads: if anything below fails before
+    # they are closed, the process hangs instead of exiting for Render to restart it
+    try:
+        # Initialize DB
+        await init_db()
+        
+        scheduler.start()
+        metrics.start_loop_monitor()
+        
+        # Set Bot Description and Commands
+        await bot.set_my_description(
+            "📅 Школьный бот-помощник.\n\n"
+            "✅ Домашнее задание на 10 дней вперед\n"
+            "✅ Расписание уроков\n"
+            "✅ Уведомления о новых заданиях\n\n"
+            "Нажми /start, чтобы начать пользоваться!"
+        )
+        await bot.set_my_short_description("ДЗ, Расписание, Уведомления")
+        
+        from aiogram.types import BotCommand
+        commands = [
+            BotCommand(command="start", description="Запустить бота"),
+            BotCommand(command="dzd", description="Найти ДЗ (10 дней)"),
+            BotCommand(command="raspisanie", description="Расписание"),
+            BotCommand(command="find", description="Поиск по ДЗ"),
+            BotCommand(command="class", description="Выбрать класс"),
+            BotCommand(command="remind", description="Время напоминаний"),
+            BotCommand(command="help", description="Помощь"),
+            BotCommand(command="cancel", description="Отмена действия")
+        ]
+        await bot.set_my_commands(commands)
+        
+        # Deliver queued broadcasts, including ones interrupted by a restart
+        start_outbox_worker(bot)
+        # Delete bot replies on time, including ones scheduled before a restart
+        await deletion_scheduler.start(bot)
+        
+        # Start web server (for Render keep-alive, and webhook updates if enabled)
+        runner = await run_web_server(create_web_app(dp, bot))
+        
+        if WEBHOOK_URL:
+            # Updates that arrived while we were down are kept and delivered now
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=False
+            )
+            print(f"Webhook set: {WEBHOOK_URL}{WEBHOOK_PATH}")
+            # Render stops the service with SIGTERM; without a handler the process dies
+            # before the cleanup below flushes FSM state and pending deletions
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                with suppress(NotImplementedError):  # Windows
+                    loop.add_signal_handler(sig, stop.set)
+            await stop.wait()
+        else:
+            # Polling fallback; pending updates are processed, not dropped
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
+    finally:
+        # Each step is a no-op for the parts that never started
+        if runner:
+            await runner.cleanup()
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await metrics.stop_loop_monitor()
+        await stop_outbox_worker()
+        await deletion_scheduler.stop()
+        await dp.storage.close()
+        await close_db()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,42 @@
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramMigrateToChat,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from utils.metrics import API_REQUESTS, API_SECONDS
+
+# Most specific first: TelegramMigrateToChat is not a TelegramBadRequest, but keep the order explicit
+ERROR_RESULTS = (
+    (TelegramRetryAfter, "flood_wait"),
+    (TelegramMigrateToChat, "migrated"),
+    (TelegramForbiddenError, "forbidden"),
+    (TelegramBadRequest, "bad_request"),
+    (TelegramServerError, "server_error"),
+    (TelegramNetworkError, "network_error"),
+)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Session middleware counting every Bot API call by method and result."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await make_request(bot, method)
+            result = "ok"
+            return response
+        except Exception as e:
+            result = next((label for error, label in ERROR_RESULTS if isinstance(e, error)), "error")
+            raise
+        finally:
+            API_REQUESTS.inc(method=name, result=result)
+            API_SECONDS.observe(time.perf_counter() - started, method=name)
@@ -0,0 +1,213 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+from aiogram.types import FSInputFile
+
+from config import SLOW_HANDLER_MS
+from utils.metrics import Histogram
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "profiles")
+# Stack sampling period of the "sample" mode, seconds
+SAMPLE_INTERVAL = 0.005
+
+HANDLER_SECONDS = Histogram("bot_handler_duration_seconds", "Handler run time", ["router", "handler"])
+
+slow_log = logging.getLogger("bot.slow")
+
+
+class StackSampler:
+    """
+    Statistical profiler: a thread samples the event loop thread's stack every
+    `interval` seconds. Output is in collapsed-stack format ("a;b;c count"),
+    which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileCapture:
+    """Profiles the process while the next `updates` updates are processed."""
+
+    def __init__(self, updates: int, mode: str, chat_id: int):
+        self.remaining = updates
+        self.updates = updates
+        self.mode = mode
+        self.chat_id = chat_id
+        self.started = None
+        self._profiler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == "sample":
+            self._profiler = StackSampler()
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        """Write the profile to PROFILE_DIR; returns (path, short text summary)."""
+        elapsed = time.perf_counter() - self.started
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = datetime.now().strftime("%Y%m%d-%H%M%S")
+        header = f"{self.updates - max(self.remaining, 0)} обновлений за {elapsed:.1f} с"
+        if self.mode == "sample":
+            self._profiler.stop()
+            path = os.path.join(PROFILE_DIR, f"{name}.folded")
+            self._profiler.dump(path)
+            return path, f"{header}, {sum(self._profiler.stacks.values())} сэмплов"
+
+        self._profiler.disable()
+        path = os.path.join(PROFILE_DIR, f"{name}.prof")
+        self._profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(self._profiler, stream=text).sort_stats("cumulative").print_stats(15)
+        with open(os.path.join(PROFILE_DIR, f"{name}.txt"), "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+        return path, header
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner middleware: runs right around the handler that matched, so it knows
+    the router and handler name. Results go to the outer middleware's record.
+    """
+
+    async def __call__(self, handler, event, data):
+        router = data.get("event_router")
+        callback = data["handler"].callback
+        name = getattr(callback, "__name__", repr(callback))
+        router_name = router.name if router else "-"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, router=router_name, handler=name)
+            record = data.get("profiling_record")
+            if record is not None:
+                record.update(router=router_name, handler=name, handler_ms=round(elapsed * 1000, 1))
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """
+    Outer update middleware. Logs a JSON record for every update slower than
+    `slow_ms`, and runs profile captures requested with capture().
+    """
+
+    def __init__(self, slow_ms: int = SLOW_HANDLER_MS):
+        self.slow_ms = slow_ms
+        self.handler_timer = HandlerTimingMiddleware()
+        self.capture_pending = None
+        self._capture = None
+
+    def setup(self, dp):
+        """Register on the dispatcher: outer on updates, inner on every event type."""
+        dp.update.outer_middleware(self)
+        for name, observer in dp.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self.handler_timer)
+
+    def capture(self, updates: int, mode: str, chat_id: int):
+        """Profile the next `updates` updates; the result is sent to chat_id."""
+        self.capture_pending = ProfileCapture(updates, mode, chat_id)
+
+    async def stop_capture(self, bot) -> bool:
+        """Finish the running capture early and send what was collected."""
+        self.capture_pending = None
+        if self._capture is None:
+            return False
+        await self._finish(bot)
+        return True
+
+    @property
+    def capturing(self) -> bool:
+        return self._capture is not None or self.capture_pending is not None
+
+    async def __call__(self, handler, event, data):
+        if self._capture is None and self.capture_pending is not None:
+            self._capture, self.capture_pending = self.capture_pending, None
+            self._capture.start()
+
+        record = {}
+        data["profiling_record"] = record
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            total_ms = (time.perf_counter() - started) * 1000
+            if total_ms >= self.slow_ms:
+                self._log_slow(event, data, record, total_ms)
+            await self._count_capture(data["bot"])
+
+    @staticmethod
+    def _log_slow(event, data, record, total_ms: float):
+        context = data.get("event_context")
+        record = {
+            "update_id": event.update_id,
+            "type": event.event_type,
+            "chat_id": context.chat.id if context and context.chat else None,
+            "user_id": context.user.id if context and context.user else None,
+            **record,
+            "total_ms": round(total_ms, 1),
+        }
+        slow_log.warning(json.dumps(record, ensure_ascii=False))
+
+    async def _count_capture(self, bot):
+        capture = self._capture
+        if capture is None:
+            return
+        capture.remaining -= 1
+        if capture.remaining <= 0:
+            await self._finish(bot)
+
+    async def _finish(self, bot):
+        capture, self._capture = self._capture, None
+        try:
+            path, summary = capture.stop()
+            logging.info(f"Profile saved to {path}: {summary}")
+            await bot.send_document(capture.chat_id, FSInputFile(path), caption=f"🔬 Профиль: {summary}")
+        except Exception:
+            logging.exception("Failed to save profile")
+
+
+# Registered on the dispatcher in main.py; admins start captures with /profile
+profiler = ProfilingMiddleware()
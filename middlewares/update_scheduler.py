@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from contextlib import nullcontext
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from config import ADMIN_IDS, UPDATE_CONCURRENCY, UPDATE_CHAT_QUEUE, UPDATE_MAX_WAITING
+from utils.metrics import UPDATES, UPDATE_SECONDS, UPDATE_WAIT_SECONDS, UPDATES_RUNNING, UPDATES_WAITING
+
+
+class UpdateSchedulerMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that sits in front of all routers:
+    - at most `max_concurrent` updates are processed at once;
+    - updates from one chat are processed one at a time, in arrival order
+      (asyncio.Lock wakes waiters FIFO), so FSM read-modify-write doesn't race;
+    - when a chat's queue or the global backlog is full, new updates are dropped.
+    Admin updates are never dropped.
+    """
+
+    def __init__(self, max_concurrent: int = UPDATE_CONCURRENCY, max_chat_queue: int = UPDATE_CHAT_QUEUE,
+                 max_waiting: int = UPDATE_MAX_WAITING):
+        self.max_chat_queue = max_chat_queue
+        self.max_waiting = max_waiting
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        # queue key -> [lock, updates queued or running for it]
+        self._queues = {}
+        self.running = 0
+        self.waiting = 0
+        self.processed = 0
+        self.shed = 0
+
+    @staticmethod
+    def _queue_key(data):
+        context = data.get("event_context")
+        if context is None:
+            return None
+        if context.chat:
+            return context.chat.id
+        if context.user:
+            # Inline queries and the like have no chat; order them per user
+            return f"user:{context.user.id}"
+        return None
+
+    def _should_shed(self, key, data) -> bool:
+        user = data.get("event_from_user")
+        if user and user.id in ADMIN_IDS:
+            return False
+        if self.waiting >= self.max_waiting:
+            return True
+        queue = self._queues.get(key)
+        return queue is not None and queue[1] >= self.max_chat_queue
+
+    async def __call__(self, handler, event, data):
+        key = self._queue_key(data)
+        event_type = event.event_type
+        if self._should_shed(key, data):
+            self.shed += 1
+            UPDATES.inc(type=event_type, outcome="shed")
+            logging.warning(f"Update {event.update_id} dropped: queue full (chat {key}, waiting {self.waiting})")
+            return UNHANDLED
+
+        queue = self._queues.setdefault(key, [asyncio.Lock(), 0])
+        queue[1] += 1
+        self.waiting += 1
+        UPDATES_WAITING.inc()
+        started = False
+        queued_at = time.perf_counter()
+        try:
+            # Updates without a chat or user don't need ordering
+            lock = queue[0] if key is not None else nullcontext()
+            async with lock:
+                async with self._semaphore:
+                    self.waiting -= 1
+                    UPDATES_WAITING.dec()
+                    started = True
+                    self.running += 1
+                    UPDATES_RUNNING.inc()
+                    began = time.perf_counter()
+                    UPDATE_WAIT_SECONDS.observe(began - queued_at)
+                    outcome = "error"
+                    try:
+                        result = await handler(event, data)
+                        outcome = "unhandled" if result is UNHANDLED else "handled"
+                        return result
+                    finally:
+                        self.running -= 1
+                        UPDATES_RUNNING.dec()
+                        self.processed += 1
+                        UPDATES.inc(type=event_type, outcome=outcome)
+                        UPDATE_SECONDS.observe(time.perf_counter() - began, type=event_type)
+        finally:
+            if not started:
+                self.waiting -= 1
+                UPDATES_WAITING.dec()
+            queue[1] -= 1
+            if queue[1] == 0:
+                self._queues.pop(key, None)
+
+    def stats(self) -> dict:
+        depths = [queue[1] for key, queue in self._queues.items() if key is not None]
+        return {
+            'running': self.running,
+            'waiting': self.waiting,
+            'queued_chats': len(depths),
+            'max_chat_depth': max(depths, default=0),
+            'processed': self.processed,
+            'shed': self.shed,
+        }
+
+
+# Registered on the dispatcher in main.py; stats() is read by admin tools
+update_scheduler = UpdateSchedulerMiddleware()
@@ -0,0 +1,147 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+
+from utils.db_api import DAYS, normalize_grade, iter_backup_rows
+
+# Columns of the backup CSV written by /export and read by /import.
+# type is "lesson" (grade, day, position, subject) or "homework"
+# (grade, date, subject, description, attachments as "photo:<file_id>;document:<file_id>").
+COLUMNS = ("type", "grade", "date", "day", "position", "subject", "description", "attachments")
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "exports")
+# Errors listed back to the admin; the import is rejected as a whole either way
+MAX_REPORTED_ERRORS = 10
+
+
+class ImportFormatError(ValueError):
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def _decode(data: bytes) -> str:
+    # Excel saves CSV as cp1251 on Russian Windows, with a BOM in UTF-8 mode
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1251")
+
+
+def _read_rows(filename: str, data: bytes) -> list:
+    text = _decode(data)
+    if (filename or "").lower().endswith(".json"):
+        rows = json.loads(text)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ImportFormatError(["JSON должен быть списком объектов с полями как в CSV."])
+        return rows
+    # Excel in Russian locales separates columns with ";"
+    header = text.split("\n", 1)[0]
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    return list(csv.DictReader(io.StringIO(text), delimiter=delimiter))
+
+
+def _parse_date(value: str) -> date:
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"дата «{value}» не в формате ГГГГ-ММ-ДД или ДД.ММ.ГГГГ")
+
+
+def _parse_attachments(value) -> list:
+    if isinstance(value, list):
+        return [{'file_id': a['file_id'], 'file_type': a['file_type']} for a in value]
+    attachments = []
+    for item in filter(None, (value or "").split(";")):
+        file_type, _, file_id = item.strip().partition(":")
+        if file_type not in ("photo", "document") or not file_id:
+            raise ValueError(f"вложение «{item}» должно быть вида photo:<file_id> или document:<file_id>")
+        attachments.append({'file_id': file_id, 'file_type': file_type})
+    return attachments
+
+
+def _parse_row(row: dict, homework: list, lessons: dict):
+    def field(name):
+        value = row.get(name)
+        return str(value).strip() if value is not None else ""
+
+    kind = field("type").lower()
+    grade = ""
+    if field("grade"):
+        grade = normalize_grade(field("grade"))
+        if grade is None:
+            raise ValueError(f"класс «{field('grade')}» не распознан")
+    subject = field("subject")
+    if not subject:
+        raise ValueError("не указан предмет")
+
+    if kind == "lesson":
+        day = field("day").capitalize()
+        if day not in DAYS[:6]:
+            raise ValueError(f"день «{field('day')}» должен быть от понедельника до субботы")
+        if field("position") and not field("position").isdigit():
+            raise ValueError(f"номер урока «{field('position')}» должен быть числом")
+        position = int(field("position") or 0)
+        lessons.setdefault((grade, day), []).append((position, subject))
+    elif kind == "homework":
+        attachments = _parse_attachments(row.get("attachments"))
+        # Homework sent as a bare photo has no text; stored as NULL like the admin flow does
+        if not field("description") and not attachments:
+            raise ValueError("не указано ни задание, ни вложения")
+        homework.append({
+            'subject': subject,
+            'grade': grade,
+            'hw_date': _parse_date(field("date")),
+            'description': field("description") or None,
+            'attachments': attachments,
+        })
+    else:
+        raise ValueError(f"тип «{field('type')}» должен быть lesson или homework")
+
+
+def parse_import(filename: str, data: bytes):
+    """
+    Parse an uploaded CSV/JSON backup into (homework, lessons) for db_api.import_bulk.
+    Raises ImportFormatError listing the bad rows; nothing is imported in that case.
+    """
+    try:
+        rows = _read_rows(filename, data)
+    except (ValueError, csv.Error) as e:
+        raise ImportFormatError([f"Не удалось прочитать файл: {e}"])
+
+    homework, positioned, errors = [], {}, []
+    # Line 1 of a CSV is the header
+    for line, row in enumerate(rows, 2):
+        try:
+            _parse_row(row, homework, positioned)
+        except (ValueError, KeyError, TypeError) as e:
+            errors.append(f"Строка {line}: {e}")
+    if errors:
+        extra = len(errors) - MAX_REPORTED_ERRORS
+        raise ImportFormatError(errors[:MAX_REPORTED_ERRORS] + ([f"...и ещё {extra}"] if extra > 0 else []))
+    if not homework and not positioned:
+        raise ImportFormatError(["В файле нет ни уроков, ни заданий."])
+
+    # Lessons keep file order unless positions are given
+    lessons = {
+        key: [subject for _, subject in sorted(items, key=lambda item: item[0])]
+        for key, items in positioned.items()
+    }
+    return homework, lessons
+
+
+async def write_backup() -> str:
+    """Stream timetables and homework into a CSV file under EXPORT_DIR; returns its path."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, datetime.now().strftime("backup-%Y%m%d-%H%M%S.csv"))
+    # BOM so Excel opens the Cyrillic text correctly
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        async for row in iter_backup_rows():
+            writer.writerow(row)
+    return path
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramMigrateToChat,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from utils.db_api import deactivate_chats, migrate_chat
+from utils.metrics import BROADCAST_CHATS, BROADCAST_MESSAGES, BROADCAST_SECONDS, BROADCAST_THROUGHPUT, FLOOD_WAITS
+
+# Telegram limits: ~30 messages/sec across all chats, 1 message/sec in a private
+# chat and 20 messages/minute in a group. We stay slightly below them.
+GLOBAL_RATE = 25
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+# Concurrent per-chat workers; the token bucket is what actually bounds throughput
+CONCURRENCY = 25
+MAX_RETRIES = 4
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Global token bucket plus per-chat spacing. A flood wait from Telegram
+    applies to the whole bot, so pause() holds back every sender.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE):
+        self.bucket = TokenBucket(rate)
+        self._chat_next = {}
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        interval = GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL
+        while True:
+            now = time.monotonic()
+            wait = max(self._resume_at, self._chat_next.get(chat_id, 0.0)) - now
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self.bucket.acquire()
+        now = time.monotonic()
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        self._chat_next[chat_id] = now + interval
+
+
+# One limiter for the whole process so parallel broadcasts share Telegram's budget
+limiter = RateLimiter()
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    delivered: int = 0
+    failed: int = 0
+    blocked: int = 0
+    messages: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """API calls per second"""
+        return self.messages / self.elapsed if self.elapsed > 0 else 0.0
+
+
+
+# Results passed to on_result callbacks
+DELIVERED = "delivered"
+BLOCKED = "blocked"     # permanently unreachable: bot blocked/kicked or chat gone
+FAILED = "failed"
+
+# Bad Request descriptions that mean the chat will never accept messages again
+PERMANENT_BAD_REQUESTS = (
+    "chat not found",
+    "user is deactivated",
+    "peer_id_invalid",
+    "group chat was deactivated",
+    "bot was kicked",
+)
+
+
+def is_permanent_error(error) -> bool:
+    """Whether a delivery error means the chat should be dropped from fan-out."""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    if isinstance(error, TelegramBadRequest):
+        description = error.message.lower()
+        return any(reason in description for reason in PERMANENT_BAD_REQUESTS)
+    return False
+
+
+async def _send_with_retry(step, chat_id: int, limiter: RateLimiter):
+    """Run one API call, honoring flood waits and retrying transient errors with backoff."""
+    attempt = 0
+    while True:
+        await limiter.acquire(chat_id)
+        try:
+            return await step(chat_id)
+        except TelegramRetryAfter as e:
+            # Not counted as an attempt: Telegram told us exactly when to come back
+            logging.warning(f"Flood wait {e.retry_after}s while sending to {chat_id}")
+            FLOOD_WAITS.inc()
+            limiter.pause(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError):
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise
+            await asyncio.sleep(min(30, 0.5 * 2 ** attempt) + random.random())
+
+
+async def deliver(chat_id: int, steps, limiter: RateLimiter = limiter):
+    """
+    Send every step to one chat. Returns (status, api_calls, error, final_chat_id).
+    Steps are callables `step(chat_id) -> awaitable`, one Telegram API call each.
+    final_chat_id differs from chat_id when the group migrated to a supergroup.
+    """
+    calls = 0
+    try:
+        for step in steps:
+            try:
+                await _send_with_retry(step, chat_id, limiter)
+            except TelegramMigrateToChat as e:
+                chat_id = e.migrate_to_chat_id
+                await _send_with_retry(step, chat_id, limiter)
+            calls += 1
+        return DELIVERED, calls, None, chat_id
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        return BLOCKED if is_permanent_error(e) else FAILED, calls, e, chat_id
+    except (TelegramAPIError, TelegramNetworkError, TelegramServerError) as e:
+        return FAILED, calls, e, chat_id
+    except Exception as e:
+        logging.exception(f"Unexpected error while sending to {chat_id}")
+        return FAILED, calls, e, chat_id
+
+
+async def _update_chats(dead, migrated):
+    """Persist chats found dead or migrated during a broadcast."""
+    if dead:
+        await deactivate_chats(dead)
+        logging.info(f"Deactivated {len(dead)} unreachable chats")
+    for old_chat_id, new_chat_id in migrated:
+        await migrate_chat(old_chat_id, new_chat_id)
+
+
+async def broadcast(chat_ids, steps, *, concurrency: int = CONCURRENCY, on_result=None,
+                    limiter: RateLimiter = limiter, spread: float = 0) -> BroadcastResult:
+    """
+    Deliver the same sequence of API calls to many chats concurrently.
+    on_result(chat_id, status, error) is called once per chat if given.
+    With spread, chats start evenly over that many seconds (each at a random
+    point of its own slot) instead of as fast as the rate limits allow.
+    """
+    result = BroadcastResult(total=len(chat_ids))
+    dead, migrated = [], []
+    queue = asyncio.Queue()
+    for index, chat_id in enumerate(chat_ids):
+        queue.put_nowait((index, chat_id))
+    slot = spread / len(chat_ids) if spread and chat_ids else 0
+
+    async def worker():
+        while True:
+            try:
+                index, chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if slot:
+                delay = result.started + (index + random.random()) * slot - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            status, calls, error, final_chat_id = await deliver(chat_id, steps, limiter)
+            result.messages += calls
+            BROADCAST_MESSAGES.inc(calls)
+            BROADCAST_CHATS.inc(status=status)
+            if final_chat_id != chat_id:
+                migrated.append((chat_id, final_chat_id))
+            if status == DELIVERED:
+                result.delivered += 1
+            elif status == BLOCKED:
+                result.blocked += 1
+                dead.append((chat_id, str(error)))
+            else:
+                result.failed += 1
+                logging.warning(f"Broadcast to {chat_id} failed: {error}")
+            if on_result:
+                await on_result(chat_id, status, error)
+
+    workers = min(concurrency, len(chat_ids))
+    try:
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    finally:
+        await _update_chats(dead, migrated)
+    result.finished = time.monotonic()
+    BROADCAST_SECONDS.observe(result.elapsed)
+    BROADCAST_THROUGHPUT.set(result.throughput)
+    logging.info(
+        f"Broadcast done: {result.delivered}/{result.total} delivered, "
+        f"{result.blocked} blocked, {result.failed} failed in {result.elapsed:.1f}s"
+    )
+    return result
+
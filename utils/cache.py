@@ -0,0 +1,83 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from utils.metrics import CACHE_LOOKUPS
+
+
+class AsyncCache:
+    """
+    Read-through cache with TTL and LRU eviction.
+    Keys are tuples whose first item is a namespace, e.g. ("schedule", "Вторник").
+    Concurrent misses on the same key share one load (single-flight).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        # Bumped on every invalidation so loads that started earlier don't store stale values
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(namespace, *prefix) runs on every invalidate(), for caches derived from this one"""
+        self._listeners.append(callback)
+
+    async def get_or_load(self, key: tuple, loader):
+        """Return the cached value for key, calling `await loader()` on a miss."""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(result="miss")
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            CACHE_LOOKUPS.inc(result="coalesced")
+        # shield: one caller being cancelled must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        generation = self._generation
+        value = await loader()
+        if generation == self._generation:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, namespace: str = None, *prefix):
+        """Drop keys in a namespace (optionally only those starting with prefix), or everything."""
+        self._generation += 1
+        for callback in self._listeners:
+            callback(namespace, *prefix)
+        if namespace is None:
+            self._data.clear()
+            return
+        match = (namespace, *prefix)
+        for key in [k for k in self._data if k[:len(match)] == match]:
+            del self._data[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -1,16 +1,133 @@
 import asyncio
-from aiogram import types
+import heapq
 import logging
+import time
+from itertools import groupby
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramRetryAfter
+
+from utils.broadcast import TokenBucket
+from utils.db_api import add_pending_deletions, get_pending_deletions, remove_pending_deletions
+from utils.metrics import DELETION_LAG, DELETIONS_PENDING
+
+# deleteMessages accepts up to 100 IDs from one chat per call
+DELETE_BATCH = 100
+# deleteMessages calls per second, kept well below the send budget
+DELETE_RATE = 5
+# Newly scheduled deletions are written to SQLite at least this often
+FLUSH_INTERVAL = 2.0
+
+
+class DeletionScheduler:
+    """
+    One background task deletes every scheduled message. Due times live in a
+    min-heap and are mirrored to SQLite so they survive restarts.
+    """
+
+    def __init__(self, rate: float = DELETE_RATE):
+        self._heap = []
+        self._unsaved = []
+        self._wakeup = asyncio.Event()
+        self._bucket = TokenBucket(rate)
+        self._task = None
+        self.bot = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        delete_at = time.time() + delay
+        item = (delete_at, chat_id, message_id)
+        earliest = not self._heap or delete_at < self._heap[0][0]
+        heapq.heappush(self._heap, item)
+        self._unsaved.append((chat_id, message_id, delete_at))
+        if earliest:
+            self._wakeup.set()
+
+    async def start(self, bot: Bot):
+        """Load deletions left over from the previous run and start the worker."""
+        self.bot = bot
+        for chat_id, message_id, delete_at in await get_pending_deletions():
+            heapq.heappush(self._heap, (delete_at, chat_id, message_id))
+        if self._heap:
+            logging.info(f"Restored {len(self._heap)} scheduled message deletions")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush()
+
+    async def _flush(self):
+        if self._unsaved:
+            items, self._unsaved = self._unsaved, []
+            await add_pending_deletions(items)
+
+    def _pop_due(self):
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    async def _delete_batch(self, chat_id: int, message_ids):
+        while True:
+            await self._bucket.acquire()
+            try:
+                await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                # Already deleted, too old (48h) or no rights - nothing to retry
+                logging.warning(f"Failed to delete {len(message_ids)} messages in {chat_id}: {e}")
+                return
+
+    async def _run(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                await self._flush()
+                due = self._pop_due()
+                if due:
+                    now = time.time()
+                    for delete_at, _, _ in due:
+                        DELETION_LAG.observe(now - delete_at)
+                    due.sort(key=lambda item: item[1])
+                    done = []
+                    for chat_id, items in groupby(due, key=lambda item: item[1]):
+                        message_ids = [item[2] for item in items]
+                        for i in range(0, len(message_ids), DELETE_BATCH):
+                            await self._delete_batch(chat_id, message_ids[i:i + DELETE_BATCH])
+                        done.extend((chat_id, message_id) for message_id in message_ids)
+                    await remove_pending_deletions(done)
+                    continue
+
+                timeout = FLUSH_INTERVAL
+                if self._heap:
+                    timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Deletion scheduler failed, retrying")
+                await asyncio.sleep(FLUSH_INTERVAL)
+
+
+scheduler = DeletionScheduler()
+DELETIONS_PENDING.set_function(lambda: len(scheduler))
 
-async def delete_msg(message: types.Message, delay: int = 30):
-    """Wait for 'delay' seconds and then delete the message."""
-    await asyncio.sleep(delay)
-    try:
-        await message.delete()
-    except Exception as e:
-        logging.warning(f"Failed to delete message {message.message_id}: {e}")
 
 def schedule_deletion(message: types.Message, delay: int = 30):
     """Schedule background deletion of a message."""
     if message:
-        asyncio.create_task(delete_msg(message, delay))
+        scheduler.schedule(message.chat.id, message.message_id, delay)
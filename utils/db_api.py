@@ -1,60 +1,238 @@
-import aiosqlite
 import datetime
+import json
 import os
+import re
+from utils.db_pool import ConnectionManager
+from utils.migrations import migrate
+from utils.cache import AsyncCache
+from utils.metrics import CACHE_ENTRIES
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "bot_database.db")
+DB_PATH = os.getenv("DB_PATH") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "bot_database.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
+# Weekday names indexed by date.weekday(), as stored in schedule.day_name
+DAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+# Shared connections, opened once in init_db() and closed by close_db() on shutdown
+pool = ConnectionManager(DB_PATH, readers=int(os.getenv("DB_READERS", 4)))
+
+# Read-through cache for schedule and homework subject lookups.
+# Every write below invalidates the namespaces it affects.
+cache = AsyncCache(maxsize=1024, ttl=int(os.getenv("CACHE_TTL", 300)))
+CACHE_ENTRIES.set_function(lambda: cache.stats()['size'])
+# Class of each chat, looked up on every homework view; kept apart so it can't evict the above
+chat_grades = AsyncCache(maxsize=10000, ttl=3600)
+
+def _invalidate_homework(hw_date):
+    cache.invalidate("hw_subjects", hw_date)
+    cache.invalidate("day_subjects", hw_date)
+
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Open the connection pool and upgrade the schema in place."""
+    await pool.open()
+    await migrate(pool)
+    await _load_subjects()
+
+async def close_db():
+    await pool.close()
+
+async def ping_db():
+    """Round-trip a trivial query; raises if the database is unusable."""
+    async with pool.read("ping_db") as db:
+        async with db.execute("SELECT 1") as cursor:
+            await cursor.fetchone()
+
+async def add_chat(chat_id: int):
+    """Register a chat, or reactivate it if the bot was blocked/kicked before."""
+    async with pool.write("add_chat") as db:
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS homework (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                subject TEXT NOT NULL,
-                grade TEXT,
-                hw_date DATE NOT NULL,
-                description TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+            INSERT INTO chats (chat_id) VALUES (?)
+            ON CONFLICT(chat_id) DO UPDATE SET is_active = 1, deactivated_at = NULL, last_error = NULL
+            WHERE is_active = 0
+        """, (chat_id,))
+
+async def get_all_chats():
+    """Chats that can still receive messages"""
+    async with pool.read("get_all_chats") as db:
+        async with db.execute("SELECT chat_id FROM chats WHERE is_active = 1") as cursor:
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+
+async def deactivate_chats(chats):
+    """chats: list of (chat_id, reason). Inactive chats are skipped by every fan-out."""
+    async with pool.write("deactivate_chats") as db:
+        await db.executemany("""
+            UPDATE chats SET is_active = 0, deactivated_at = CURRENT_TIMESTAMP, last_error = ?
+            WHERE chat_id = ? AND is_active = 1
+        """, [(reason, chat_id) for chat_id, reason in chats])
+
+async def migrate_chat(old_chat_id: int, new_chat_id: int):
+    """A group was upgraded to a supergroup and got a new ID; its settings move along."""
+    async with pool.write("migrate_chat") as db:
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS homework_attachments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                homework_id INTEGER,
-                file_id TEXT,
-                file_type TEXT,
-                FOREIGN KEY(homework_id) REFERENCES homework(id) ON DELETE CASCADE
-            )
-        """)
+            INSERT INTO chats (chat_id) VALUES (?)
+            ON CONFLICT(chat_id) DO UPDATE SET is_active = 1, deactivated_at = NULL, last_error = NULL
+        """, (new_chat_id,))
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS schedule (
-                day_name TEXT PRIMARY KEY,
-                lessons TEXT
-            )
-        """)
+            UPDATE chats SET (grade, remind_at) = (SELECT grade, remind_at FROM chats WHERE chat_id = :old)
+            WHERE chat_id = :new AND EXISTS (SELECT 1 FROM chats WHERE chat_id = :old)
+        """, {"old": old_chat_id, "new": new_chat_id})
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id INTEGER PRIMARY KEY
-            )
-        """)
-        await db.commit()
+            UPDATE chats SET is_active = 0, deactivated_at = CURRENT_TIMESTAMP, last_error = ?
+            WHERE chat_id = ?
+        """, (f"migrated to {new_chat_id}", old_chat_id))
+    chat_grades.invalidate("chat_grade", new_chat_id)
 
-async def add_chat(chat_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", (chat_id,))
-        await db.commit()
+# --- Reminders ---
+REMIND_AT_RE = re.compile(r'^([01]?\d|2[0-3])[:.]([0-5]\d)$')
 
-async def get_all_chats():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT chat_id FROM chats") as cursor:
+def normalize_remind_at(text):
+    """'9.05' -> '09:05'; None if the text isn't a time of day"""
+    match = REMIND_AT_RE.match((text or '').strip())
+    return f"{int(match.group(1)):02d}:{match.group(2)}" if match else None
+
+async def set_chat_reminder(chat_id: int, remind_at):
+    """remind_at: 'HH:MM', or None to stop reminders for the chat"""
+    async with pool.write("set_chat_reminder") as db:
+        await db.execute("""
+            INSERT INTO chats (chat_id, remind_at) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET remind_at = excluded.remind_at,
+                is_active = 1, deactivated_at = NULL, last_error = NULL
+        """, (chat_id, remind_at))
+
+async def get_chat_reminder(chat_id: int):
+    async with pool.read("get_chat_reminder") as db:
+        async with db.execute("SELECT remind_at FROM chats WHERE chat_id = ?", (chat_id,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else '15:00'
+
+async def get_reminder_chats(remind_at: str) -> dict:
+    """Active chats reminded at 'HH:MM', grouped by class: {grade or None: [chat_id, ...]}"""
+    async with pool.read("get_reminder_chats") as db:
+        async with db.execute("""
+            SELECT chat_id, grade FROM chats WHERE remind_at = ? AND is_active = 1
+        """, (remind_at,)) as cursor:
+            rows = await cursor.fetchall()
+    chats = {}
+    for chat_id, grade in rows:
+        chats.setdefault(grade, []).append(chat_id)
+    return chats
+
+# --- Classes ---
+# A chat subscribed to a class (chats.grade) sees and receives only that class's
+# homework plus homework for all classes. Chats without a class get everything.
+# In homework and lessons, grade '' means all classes / the default timetable.
+
+GRADE_RE = re.compile(r'^\d{1,2}[А-ЯЁ]?$')
+# Latin letters typed instead of their Cyrillic look-alikes ("5A" is "5А")
+LATIN_TO_CYRILLIC = str.maketrans("ABCEHKMOPTXY", "АВСЕНКМОРТХУ")
+
+def normalize_grade(text):
+    """'5 а' -> '5А'; None if the text doesn't look like a class"""
+    grade = re.sub(r'[\s\-]', '', text or '').upper().translate(LATIN_TO_CYRILLIC)
+    return grade if GRADE_RE.match(grade) else None
+
+def _grade_sort_key(grade: str):
+    number = re.match(r'\d+', grade)
+    return (int(number.group()) if number else 0, grade)
+
+def _grade_filter(grade, column: str = "grade"):
+    """SQL condition (and params) limiting homework to a class; None means no limit"""
+    if grade is None:
+        return "", ()
+    return f" AND {column} IN (?, '')", (grade,)
+
+async def set_chat_grade(chat_id: int, grade):
+    """Subscribe a chat to a class, or to everything with grade=None."""
+    async with pool.write("set_chat_grade") as db:
+        await db.execute("""
+            INSERT INTO chats (chat_id, grade) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET grade = excluded.grade,
+                is_active = 1, deactivated_at = NULL, last_error = NULL
+        """, (chat_id, grade))
+    chat_grades.invalidate("chat_grade", chat_id)
+
+async def get_chat_grade(chat_id: int):
+    """Class the chat is subscribed to, or None"""
+    async def load():
+        async with pool.read("get_chat_grade") as db:
+            async with db.execute("SELECT grade FROM chats WHERE chat_id = ?", (chat_id,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    return await chat_grades.get_or_load(("chat_grade", chat_id), load)
+
+async def get_grades() -> list:
+    """Classes known from subscriptions and timetables, in natural order"""
+    async with pool.read("get_grades") as db:
+        async with db.execute("""
+            SELECT grade FROM chats WHERE grade IS NOT NULL AND is_active = 1
+            UNION SELECT grade FROM lessons WHERE grade != ''
+        """) as cursor:
+            rows = await cursor.fetchall()
+    return sorted((row[0] for row in rows), key=_grade_sort_key)
+
+async def get_chats_for_grades(grades):
+    """
+    Active chats that should hear about homework of the given classes: their
+    subscribers and chats without a class. '' (all classes) means every chat.
+    """
+    grades = set(grades)
+    if '' in grades:
+        return await get_all_chats()
+    if not grades:
+        return []
+    async with pool.read("get_chats_for_grades") as db:
+        async with db.execute(f"""
+            SELECT chat_id FROM chats
+            WHERE is_active = 1 AND (grade IS NULL OR grade IN ({','.join('?' * len(grades))}))
+        """, tuple(grades)) as cursor:
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
 
+# --- Subject dictionary ---
+# The subjects table is tiny and append-only, so it is mirrored in memory in both directions
+_subject_ids = {}
+_subject_names = {}
+
+def _remember_subjects(rows):
+    for subject_id, name in rows:
+        _subject_ids[name] = subject_id
+        _subject_names[subject_id] = name
+
+async def _load_subjects():
+    async with pool.read("_load_subjects") as db:
+        async with db.execute("SELECT id, name FROM subjects") as cursor:
+            _remember_subjects(await cursor.fetchall())
+
+async def get_subject_ids(names) -> dict:
+    """{name: id} for the given subject names, registering unknown ones."""
+    missing = [name for name in dict.fromkeys(names) if name not in _subject_ids]
+    if missing:
+        async with pool.write("get_subject_ids") as db:
+            await db.executemany("INSERT OR IGNORE INTO subjects (name) VALUES (?)", [(n,) for n in missing])
+            async with db.execute(
+                f"SELECT id, name FROM subjects WHERE name IN ({','.join('?' * len(missing))})", missing
+            ) as cursor:
+                rows = await cursor.fetchall()
+        # Only after the commit, so a rolled back insert never leaves a phantom ID
+        _remember_subjects(rows)
+    return {name: _subject_ids[name] for name in names}
+
+async def get_subject_name(subject_id: int):
+    if subject_id not in _subject_names:
+        async with pool.read("get_subject_name") as db:
+            async with db.execute("SELECT id, name FROM subjects WHERE id = ?", (subject_id,)) as cursor:
+                _remember_subjects(await cursor.fetchall())
+    return _subject_names.get(subject_id)
+
 async def add_homework(subject, grade, hw_date, description, attachments=None):
     """
     attachments: list of dicts [{'file_id': '...', 'file_type': 'photo/document'}]
+    grade: class the homework is for; None or '' for all classes
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    grade = grade or ''
+    await get_subject_ids([subject])
+    async with pool.write("add_homework") as db:
         cursor = await db.execute("""
             INSERT INTO homework (subject, grade, hw_date, description)
             VALUES (?, ?, ?, ?)
@@ -68,93 +246,525 @@ async def add_homework(subject, grade, hw_date, description, attachments=None):
                     VALUES (?, ?, ?)
                 """, (hw_id, att['file_id'], att['file_type']))
         
-        await db.commit()
-        return hw_id
+    _invalidate_homework(hw_date)
+    return hw_id
 
-async def get_homework_subjects(hw_date: datetime.date):
-    """Get list of subjects that have homework for a specific date"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT DISTINCT subject FROM homework WHERE hw_date = ?
-        """, (hw_date,)) as cursor:
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+async def get_homework_subjects(hw_date: datetime.date, grade=None):
+    """Get list of subjects that have homework for a specific date (and class)"""
+    condition, params = _grade_filter(grade)
 
-async def get_homework_by_subject(hw_date: datetime.date, subject: str):
-    """Get homework and attachments for a specific subject and date"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT id, description, grade FROM homework 
-            WHERE hw_date = ? AND subject = ?
-        """, (hw_date, subject)) as cursor:
-            hw_rows = await cursor.fetchall()
-            
-        results = []
-        for row in hw_rows:
-            hw_id, desc, grade = row
-            # Get attachments
-            async with db.execute("""
-                SELECT file_id, file_type FROM homework_attachments WHERE homework_id = ?
-            """, (hw_id,)) as att_cursor:
-                att_rows = await att_cursor.fetchall()
-                attachments = [{'file_id': r[0], 'file_type': r[1]} for r in att_rows]
-            
-            results.append({
+    async def load():
+        async with pool.read("get_homework_subjects") as db:
+            async with db.execute(f"""
+                SELECT DISTINCT subject FROM homework WHERE hw_date = ?{condition}
+            """, (hw_date, *params)) as cursor:
+                rows = await cursor.fetchall()
+                return tuple(row[0] for row in rows)
+    return list(await cache.get_or_load(("hw_subjects", hw_date, grade), load))
+
+async def get_homework_grades(hw_date: datetime.date) -> set:
+    """Classes that have homework for a date ('' for homework for all classes)"""
+    async with pool.read("get_homework_grades") as db:
+        async with db.execute("SELECT DISTINCT grade FROM homework WHERE hw_date = ?", (hw_date,)) as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+# Homework rows with their attachments in one pass; attachment columns are NULL
+# for homework without files. Rows come ordered so grouping can be done in a single scan.
+HOMEWORK_WITH_ATTACHMENTS_SQL = """
+    SELECT h.id, h.hw_date, h.subject, h.description, h.grade, a.file_id, a.file_type
+    FROM homework h
+    LEFT JOIN homework_attachments a ON a.homework_id = h.id
+"""
+
+def _group_homework_rows(rows):
+    """Fold joined homework/attachment rows into {date: {subject: [homework, ...]}}"""
+    grouped = {}
+    by_id = {}
+    for hw_id, hw_date, subject, desc, grade, file_id, file_type in rows:
+        item = by_id.get(hw_id)
+        if item is None:
+            item = {
                 'id': hw_id,
                 'description': desc,
                 'grade': grade,
-                'attachments': attachments
-            })
-        return results
+                'attachments': []
+            }
+            by_id[hw_id] = item
+            day = grouped.setdefault(datetime.date.fromisoformat(hw_date), {})
+            day.setdefault(subject, []).append(item)
+        if file_id is not None:
+            item['attachments'].append({'file_id': file_id, 'file_type': file_type})
+    return grouped
+
+async def get_homework_by_subject(hw_date: datetime.date, subject: str, grade=None):
+    """Get homework and attachments for a specific subject and date"""
+    condition, params = _grade_filter(grade, "h.grade")
+    async with pool.read("get_homework_by_subject") as db:
+        async with db.execute(HOMEWORK_WITH_ATTACHMENTS_SQL + f"""
+            WHERE h.hw_date = ? AND h.subject = ?{condition}
+            ORDER BY h.id, a.id
+        """, (hw_date, subject, *params)) as cursor:
+            rows = await cursor.fetchall()
+    return _group_homework_rows(rows).get(hw_date, {}).get(subject, [])
+
+async def get_homework_range(start: datetime.date, end: datetime.date, grade=None):
+    """
+    Get all homework with attachments between start and end (inclusive) in one query.
+    Returns {date: {subject: [homework, ...]}}, dates and subjects in insertion order.
+    """
+    condition, params = _grade_filter(grade, "h.grade")
+    async with pool.read("get_homework_range") as db:
+        async with db.execute(HOMEWORK_WITH_ATTACHMENTS_SQL + f"""
+            WHERE h.hw_date BETWEEN ? AND ?{condition}
+            ORDER BY h.hw_date, h.id, a.id
+        """, (start, end, *params)) as cursor:
+            rows = await cursor.fetchall()
+    return _group_homework_rows(rows)
+
+async def get_homework(hw_date: datetime.date, grade=None):
+    """All homework for one date grouped by subject: {subject: [homework, ...]}"""
+    return (await get_homework_range(hw_date, hw_date, grade)).get(hw_date, {})
+
+# Lessons of a class's own timetable for a weekday, or of the default one if it has none
+LESSONS_FOR_GRADE_SQL = """
+    SELECT subject, position FROM lessons
+    WHERE day_name = :day AND grade = (
+        SELECT grade FROM lessons WHERE day_name = :day AND grade IN (:grade, '') ORDER BY grade = '' LIMIT 1
+    )
+"""
+
+async def get_day_subjects(hw_date: datetime.date, grade=None) -> list:
+    """
+    Subjects to offer for a date: the class's schedule for that weekday followed
+    by any other subjects that have homework. Both come back from a single query.
+    """
+    day_name = DAYS[hw_date.weekday()]
+    condition = " AND grade IN (:grade, '')" if grade is not None else ""
+
+    async def load():
+        async with pool.read("get_day_subjects") as db:
+            async with db.execute(f"""
+                SELECT 0 AS src, subject, position AS ord FROM ({LESSONS_FOR_GRADE_SQL})
+                UNION ALL
+                SELECT 1, subject, MIN(id) FROM homework WHERE hw_date = :date{condition} GROUP BY subject
+                ORDER BY src, ord
+            """, {"day": day_name, "grade": grade or '', "date": hw_date}) as cursor:
+                rows = await cursor.fetchall()
+
+        subjects = []
+        for src, subject, _ in rows:
+            if src == 0 or subject not in subjects:
+                subjects.append(subject)
+        return tuple(subjects)
+    return list(await cache.get_or_load(("day_subjects", hw_date, grade), load))
 
-async def get_homework(hw_date: datetime.date):
-    # Backward compatibility wrapper or unused now?
-    # We'll adapt it to return all HW for the date to support legacy/reminder logic if needed.
-    # But for the new requirement, we primarily use subject filtering.
-    pass 
 
+def render_schedule(subjects) -> str:
+    return "\n".join(f"{idx}. {subject}" for idx, subject in enumerate(subjects, 1))
 
-async def update_schedule(day_name, lessons):
-    async with aiosqlite.connect(DB_PATH) as db:
+async def update_schedule(day_name, subjects: list, grade: str = '') -> str:
+    """
+    Replace the lessons of a weekday for a class ('' is the default timetable).
+    The numbered display text is rendered once here and stored in
+    schedule.lessons; it is returned for convenience.
+    """
+    text = render_schedule(subjects)
+    await get_subject_ids(subjects)
+    async with pool.write("update_schedule") as db:
+        await db.execute("DELETE FROM lessons WHERE grade = ? AND day_name = ?", (grade, day_name))
+        await db.executemany("""
+            INSERT INTO lessons (grade, day_name, position, subject) VALUES (?, ?, ?, ?)
+        """, [(grade, day_name, position, subject) for position, subject in enumerate(subjects, 1)])
         await db.execute("""
-            INSERT OR REPLACE INTO schedule (day_name, lessons) VALUES (?, ?)
-        """, (day_name, lessons))
-        await db.commit()
+            INSERT OR REPLACE INTO schedule (grade, day_name, lessons) VALUES (?, ?, ?)
+        """, (grade, day_name, text))
+    # Classes without their own timetable fall back to the default one, so drop every class
+    cache.invalidate("schedule", day_name)
+    cache.invalidate("schedule_subjects", day_name)
+    # Cached per date, so every date of that weekday is affected
+    cache.invalidate("day_subjects")
+    return text
 
-async def get_schedule(day_name):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT lessons FROM schedule WHERE day_name = ?", (day_name,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+async def get_schedule(day_name, grade=None):
+    """Display text of a weekday's schedule for a class, falling back to the default one"""
+    async def load():
+        async with pool.read("get_schedule") as db:
+            async with db.execute("""
+                SELECT lessons FROM schedule WHERE day_name = ? AND grade IN (?, '')
+                ORDER BY grade = '' LIMIT 1
+            """, (day_name, grade or '')) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    return await cache.get_or_load(("schedule", day_name, grade), load)
 
 async def delete_homework(hw_date: datetime.date):
     """Delete all homework for a specific date (simplified for this example)"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write("delete_homework") as db:
         await db.execute("DELETE FROM homework WHERE hw_date = ?", (hw_date,))
-        await db.commit()
+    _invalidate_homework(hw_date)
 
 async def delete_homework_subject(hw_date: datetime.date, subject: str):
     """Delete homework for a specific subject and date"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write("delete_homework_subject") as db:
         await db.execute("DELETE FROM homework WHERE hw_date = ? AND subject = ?", (hw_date, subject))
-        await db.commit()
-async def get_schedule_subjects(date_obj: datetime.date) -> list:
-    """Get list of subjects from the schedule for a specific date."""
-    days_reverse = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-    day_name = days_reverse[date_obj.weekday()]
-    
-    schedule_text = await get_schedule(day_name)
-    subjects = []
-    
-    if schedule_text:
-        import re
-        for line in schedule_text.split('\n'):
-            line = line.strip()
-            if not line: continue
-            # Try to match Number. Subject or just Subject
-            match = re.match(r'^\d+[\.\)]\s*(.*)', line)
-            if match:
-                subjects.append(match.group(1).strip())
-            else:
-                subjects.append(line)
-    return subjects
+    _invalidate_homework(hw_date)
+
+async def delete_homework_by_id(hw_id: int):
+    """Delete one homework row. Returns (hw_date, subject) of the deleted row, or None."""
+    async with pool.write("delete_homework_by_id") as db:
+        async with db.execute("SELECT hw_date, subject FROM homework WHERE id = ?", (hw_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await db.execute("DELETE FROM homework WHERE id = ?", (hw_id,))
+    hw_date = datetime.date.fromisoformat(row[0])
+    _invalidate_homework(hw_date)
+    return hw_date, row[1]
+
+# --- Bulk import / export ---
+async def import_bulk(homework: list, lessons: dict) -> dict:
+    """
+    Write a whole import in one transaction.
+    homework: [{'subject', 'grade', 'hw_date', 'description', 'attachments'}, ...];
+    rows already stored with the same date, class, subject and text are skipped,
+    so importing a backup twice changes nothing.
+    lessons: {(grade, day_name): [subject, ...]} replaces those days' timetables.
+    Returns {'homework': [inserted rows], 'skipped': count, 'days': count}.
+    """
+    await get_subject_ids([hw['subject'] for hw in homework] + [s for subjects in lessons.values() for s in subjects])
+    async with pool.write("import_bulk") as db:
+        for (grade, day_name), subjects in lessons.items():
+            await db.execute("DELETE FROM lessons WHERE grade = ? AND day_name = ?", (grade, day_name))
+            await db.executemany("""
+                INSERT INTO lessons (grade, day_name, position, subject) VALUES (?, ?, ?, ?)
+            """, [(grade, day_name, position, subject) for position, subject in enumerate(subjects, 1)])
+        await db.executemany("""
+            INSERT OR REPLACE INTO schedule (grade, day_name, lessons) VALUES (?, ?, ?)
+        """, [(grade, day_name, render_schedule(subjects)) for (grade, day_name), subjects in lessons.items()])
+
+        new = []
+        if homework:
+            dates = [hw['hw_date'] for hw in homework]
+            async with db.execute("""
+                SELECT hw_date, grade, subject, description FROM homework WHERE hw_date BETWEEN ? AND ?
+            """, (min(dates), max(dates))) as cursor:
+                seen = {tuple(row) for row in await cursor.fetchall()}
+            for hw in homework:
+                key = (hw['hw_date'].isoformat(), hw['grade'], hw['subject'], hw['description'])
+                if key not in seen:
+                    seen.add(key)
+                    new.append(hw)
+
+        if new:
+            # IDs are assigned here so attachments can be inserted with executemany too;
+            # the writer lock keeps them from racing another insert
+            async with db.execute("""
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'homework'), 0),
+                           COALESCE((SELECT MAX(id) FROM homework), 0))
+            """) as cursor:
+                next_id = (await cursor.fetchone())[0] + 1
+            for hw_id, hw in enumerate(new, next_id):
+                hw['id'] = hw_id
+            await db.executemany("""
+                INSERT INTO homework (id, subject, grade, hw_date, description) VALUES (?, ?, ?, ?, ?)
+            """, [(hw['id'], hw['subject'], hw['grade'], hw['hw_date'], hw['description']) for hw in new])
+            await db.executemany("""
+                INSERT INTO homework_attachments (homework_id, file_id, file_type) VALUES (?, ?, ?)
+            """, [(hw['id'], att['file_id'], att['file_type']) for hw in new for att in hw['attachments']])
+
+    for hw_date in {hw['hw_date'] for hw in new}:
+        _invalidate_homework(hw_date)
+    for _, day_name in lessons:
+        cache.invalidate("schedule", day_name)
+        cache.invalidate("schedule_subjects", day_name)
+    if lessons:
+        cache.invalidate("day_subjects")
+    return {'homework': new, 'skipped': len(homework) - len(new), 'days': len(lessons)}
+
+async def iter_backup_rows():
+    """
+    Timetables, then homework with attachments ("photo:<file_id>;document:<file_id>"),
+    streamed from one read snapshot. Yields dicts with the backup CSV columns.
+    """
+    async with pool.read("iter_backup_rows") as db:
+        # Readers are in autocommit mode; without a transaction each SELECT sees its own snapshot
+        await db.execute("BEGIN")
+        try:
+            async with db.execute("""
+                SELECT grade, day_name, position, subject FROM lessons ORDER BY grade, day_name, position
+            """) as cursor:
+                async for grade, day_name, position, subject in cursor:
+                    yield {'type': 'lesson', 'grade': grade, 'day': day_name, 'position': position, 'subject': subject}
+            async with db.execute("""
+                SELECT h.grade, h.hw_date, h.subject, h.description,
+                       (SELECT group_concat(a.file_type || ':' || a.file_id, ';')
+                        FROM homework_attachments a WHERE a.homework_id = h.id)
+                FROM homework h
+                -- Rows with neither text nor files would be rejected by /import
+                WHERE COALESCE(h.description, '') != '' OR EXISTS (SELECT 1 FROM homework_attachments a WHERE a.homework_id = h.id)
+                ORDER BY h.hw_date, h.id
+            """) as cursor:
+                async for grade, hw_date, subject, description, attachments in cursor:
+                    yield {'type': 'homework', 'grade': grade, 'date': hw_date, 'subject': subject,
+                           'description': description, 'attachments': attachments or ''}
+        finally:
+            await db.rollback()
+
+async def get_chats_by_grade() -> dict:
+    """Active chats grouped by class: {grade or None: [chat_id, ...]}"""
+    async with pool.read("get_chats_by_grade") as db:
+        async with db.execute("SELECT chat_id, grade FROM chats WHERE is_active = 1") as cursor:
+            rows = await cursor.fetchall()
+    chats = {}
+    for chat_id, grade in rows:
+        chats.setdefault(grade, []).append(chat_id)
+    return chats
+
+# --- Search ---
+def fts_query(text: str):
+    """
+    User text -> FTS5 query: every word quoted (so punctuation and FTS operators
+    are plain text) and prefix-matched, so "уравнен" finds "уравнения". None if no words.
+    """
+    words = re.findall(r'\w+', text or '')
+    return " ".join(f'"{word}"*' for word in words) or None
+
+async def search_homework(query: str, limit: int = 10, after=None, grade=None):
+    """
+    Homework whose subject or description matches query, best matches first.
+    Pages are keyset-paginated on (rank, id): pass the returned cursor as
+    `after` to get the next page. Returns ([homework, ...], cursor or None on the last page).
+    """
+    match = fts_query(query)
+    if match is None:
+        return [], None
+    condition, params = _grade_filter(grade, "h.grade")
+    keyset = ""
+    if after is not None:
+        keyset = " AND (f.rank, h.id) > (?, ?)"
+        params = (*params, *after)
+    async with pool.read("search_homework") as db:
+        async with db.execute(f"""
+            SELECT h.id, h.hw_date, h.subject, h.grade,
+                   snippet(homework_fts, 1, '', '', '…', 16), f.rank
+            FROM homework_fts f
+            JOIN homework h ON h.id = f.rowid
+            WHERE homework_fts MATCH ?{condition}{keyset}
+            ORDER BY f.rank, h.id
+            LIMIT ?
+        """, (match, *params, limit + 1)) as cursor:
+            rows = await cursor.fetchall()
+    items = [
+        {
+            'id': hw_id,
+            'hw_date': datetime.date.fromisoformat(hw_date),
+            'subject': subject,
+            'grade': hw_grade,
+            'snippet': snippet,
+        }
+        for hw_id, hw_date, subject, hw_grade, snippet, _ in rows[:limit]
+    ]
+    next_cursor = (rows[limit - 1][5], rows[limit - 1][0]) if len(rows) > limit else None
+    return items, next_cursor
+
+# --- Broadcast outbox ---
+async def create_broadcast_job(title: str, payload: list, chat_ids, reply_chat_id: int = None, spread: float = 0) -> int:
+    """Store a broadcast and one pending delivery row per chat in a single transaction."""
+    async with pool.write("create_broadcast_job") as db:
+        cursor = await db.execute("""
+            INSERT INTO broadcast_jobs (title, payload, reply_chat_id, spread) VALUES (?, ?, ?, ?)
+        """, (title, json.dumps(payload, ensure_ascii=False), reply_chat_id, spread))
+        job_id = cursor.lastrowid
+        await db.executemany("""
+            INSERT OR IGNORE INTO broadcast_outbox (job_id, chat_id) VALUES (?, ?)
+        """, [(job_id, chat_id) for chat_id in chat_ids])
+        return job_id
+
+async def get_unfinished_broadcast_jobs():
+    """Jobs that still have work to do (or were never closed), oldest first."""
+    async with pool.read("get_unfinished_broadcast_jobs") as db:
+        async with db.execute("""
+            SELECT id, title, payload, reply_chat_id, spread FROM broadcast_jobs
+            WHERE finished_at IS NULL ORDER BY id
+        """) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {'id': r[0], 'title': r[1], 'payload': json.loads(r[2]), 'reply_chat_id': r[3], 'spread': r[4]}
+        for r in rows
+    ]
+
+async def get_pending_broadcast_chats(job_id: int):
+    async with pool.read("get_pending_broadcast_chats") as db:
+        async with db.execute("""
+            SELECT chat_id FROM broadcast_outbox WHERE job_id = ? AND status = 'pending'
+        """, (job_id,)) as cursor:
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+
+async def save_broadcast_results(job_id: int, results):
+    """results: list of (chat_id, status, error) tuples"""
+    async with pool.write("save_broadcast_results") as db:
+        await db.executemany("""
+            UPDATE broadcast_outbox SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND chat_id = ?
+        """, [(status, error, job_id, chat_id) for chat_id, status, error in results])
+
+async def finish_broadcast_job(job_id: int):
+    async with pool.write("finish_broadcast_job") as db:
+        await db.execute("UPDATE broadcast_jobs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?", (job_id,))
+
+async def get_broadcast_progress(job_ids=None, limit: int = 5, skip_titles=()):
+    """Per-job delivery counters for the given jobs, or the latest `limit` jobs whose title isn't in skip_titles."""
+    if job_ids:
+        where = f"WHERE j.id IN ({','.join('?' * len(job_ids))})"
+        params = list(job_ids)
+    else:
+        skip = f"WHERE title NOT IN ({','.join('?' * len(skip_titles))})" if skip_titles else ""
+        where = f"WHERE j.id IN (SELECT id FROM broadcast_jobs {skip} ORDER BY id DESC LIMIT ?)"
+        params = [*skip_titles, limit]
+    async with pool.read("get_broadcast_progress") as db:
+        async with db.execute(f"""
+            SELECT j.id, j.title, j.created_at, j.finished_at,
+                   COUNT(o.chat_id),
+                   SUM(o.status = 'pending'),
+                   SUM(o.status = 'delivered'),
+                   SUM(o.status = 'blocked'),
+                   SUM(o.status = 'failed')
+            FROM broadcast_jobs j
+            LEFT JOIN broadcast_outbox o ON o.job_id = j.id
+            {where}
+            GROUP BY j.id ORDER BY j.id DESC
+        """, params) as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {
+            'id': r[0], 'title': r[1], 'created_at': r[2], 'finished_at': r[3],
+            'total': r[4], 'pending': r[5] or 0, 'delivered': r[6] or 0,
+            'blocked': r[7] or 0, 'failed': r[8] or 0
+        }
+        for r in rows
+    ]
+
+# --- Scheduled message deletions ---
+async def add_pending_deletions(items):
+    """items: list of (chat_id, message_id, delete_at unix timestamp)"""
+    async with pool.write("add_pending_deletions") as db:
+        await db.executemany("""
+            INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, delete_at) VALUES (?, ?, ?)
+        """, items)
+
+async def get_pending_deletions():
+    async with pool.read("get_pending_deletions") as db:
+        async with db.execute("SELECT chat_id, message_id, delete_at FROM pending_deletions") as cursor:
+            return await cursor.fetchall()
+
+async def remove_pending_deletions(items):
+    """items: list of (chat_id, message_id)"""
+    async with pool.write("remove_pending_deletions") as db:
+        await db.executemany("""
+            DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?
+        """, items)
+
+# --- Maintenance ---
+async def archive_homework_batch(before: datetime.date, batch: int, keep: bool = True) -> int:
+    """
+    Move up to `batch` homework rows dated before `before`, with their attachments,
+    into the archive tables (or just delete them if keep is False). Returns the row count.
+    """
+    async with pool.write("archive_homework_batch") as db:
+        async with db.execute(
+            "SELECT id FROM homework WHERE hw_date < ? ORDER BY hw_date, id LIMIT ?", (before, batch)
+        ) as cursor:
+            ids = [row[0] for row in await cursor.fetchall()]
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        if keep:
+            await db.execute(f"""
+                INSERT OR REPLACE INTO homework_archive (id, subject, grade, hw_date, description, created_at)
+                SELECT id, subject, grade, hw_date, description, created_at FROM homework WHERE id IN ({marks})
+            """, ids)
+            await db.execute(f"""
+                INSERT OR REPLACE INTO homework_attachments_archive (id, homework_id, file_id, file_type)
+                SELECT id, homework_id, file_id, file_type FROM homework_attachments WHERE homework_id IN ({marks})
+            """, ids)
+        # Attachments go by ON DELETE CASCADE, the search index by its trigger
+        await db.execute(f"DELETE FROM homework WHERE id IN ({marks})", ids)
+    return len(ids)
+
+async def prune_broadcast_jobs(days: int, batch: int) -> int:
+    """Delete up to `batch` broadcasts finished more than `days` days ago. Returns the job count."""
+    async with pool.write("prune_broadcast_jobs") as db:
+        async with db.execute("""
+            SELECT id FROM broadcast_jobs WHERE finished_at < datetime('now', ?) ORDER BY id LIMIT ?
+        """, (f"-{days} days", batch)) as cursor:
+            ids = [row[0] for row in await cursor.fetchall()]
+        if ids:
+            # Delivery rows go by ON DELETE CASCADE
+            await db.execute(f"DELETE FROM broadcast_jobs WHERE id IN ({','.join('?' * len(ids))})", ids)
+    return len(ids)
+
+async def get_db_pages() -> dict:
+    """Database file size in pages: {'page_size', 'pages', 'free'}"""
+    async with pool.read("get_db_pages") as db:
+        values = []
+        for pragma in ("page_size", "page_count", "freelist_count"):
+            async with db.execute(f"PRAGMA {pragma}") as cursor:
+                values.append((await cursor.fetchone())[0])
+    return dict(zip(('page_size', 'pages', 'free'), values))
+
+async def incremental_vacuum(pages: int) -> int:
+    """Return up to `pages` free pages to the filesystem. Returns how many were freed."""
+    async with pool.write("incremental_vacuum") as db:
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            before = (await cursor.fetchone())[0]
+        # The pragma frees one page per step, so the cursor has to be drained
+        async with db.execute(f"PRAGMA incremental_vacuum({int(pages)})") as cursor:
+            await cursor.fetchall()
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            return before - (await cursor.fetchone())[0]
+
+async def optimize_db():
+    """Refresh stale query planner statistics and fold the WAL back into the database file."""
+    async with pool.write("optimize_db") as db:
+        await db.execute("PRAGMA optimize")
+        async with db.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+            await cursor.fetchall()
+
+# --- FSM storage ---
+async def get_fsm_record(key: str):
+    """(state, data_json) for a storage key, or None"""
+    async with pool.read("get_fsm_record") as db:
+        async with db.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,)) as cursor:
+            return await cursor.fetchone()
+
+async def save_fsm_records(upserts, deletes):
+    """upserts: list of (key, state, data_json, updated_at); deletes: list of keys"""
+    async with pool.write("save_fsm_records") as db:
+        if upserts:
+            await db.executemany("""
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                    updated_at = excluded.updated_at
+            """, upserts)
+        if deletes:
+            await db.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in deletes])
+
+async def purge_fsm_records(older_than: float) -> list:
+    """Delete states not touched since `older_than` (unix time). Returns the purged keys."""
+    async with pool.write("purge_fsm_records") as db:
+        async with db.execute("SELECT key FROM fsm_states WHERE updated_at < ?", (older_than,)) as cursor:
+            keys = [row[0] for row in await cursor.fetchall()]
+        await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (older_than,))
+    return keys
+
+async def get_schedule_subjects(date_obj: datetime.date, grade=None) -> list:
+    """Get list of subjects from the class's schedule for a specific date."""
+    day_name = DAYS[date_obj.weekday()]
+
+    async def load():
+        async with pool.read("get_schedule_subjects") as db:
+            async with db.execute(LESSONS_FOR_GRADE_SQL + " ORDER BY position", {"day": day_name, "grade": grade or ''}) as cursor:
+                rows = await cursor.fetchall()
+                return tuple(row[0] for row in rows)
+    return list(await cache.get_or_load(("schedule_subjects", day_name, grade), load))
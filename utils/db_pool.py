@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from utils.metrics import DB_SECONDS, DB_WAIT_SECONDS, DB_ERRORS
+
+# Pragmas applied to every connection we open.
+# WAL lets readers run while the writer commits, NORMAL sync is safe under WAL,
+# negative cache_size is in KiB (16 MB page cache), mmap avoids read() syscalls.
+# foreign_keys is per-connection in SQLite and off by default; ON DELETE CASCADE needs it.
+PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Size of sqlite3's per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionManager:
+    """
+    Long-lived SQLite connections: one writer and a small pool of readers.
+    Writes are serialized through a lock so a transaction never interleaves
+    with another coroutine's statements.
+    """
+
+    def __init__(self, path: str, readers: int = 4):
+        self.path = path
+        self.readers_count = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        return db
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open:
+                return
+            # Writer first: switching to WAL needs a connection that can write
+            self._writer = await self._connect()
+            self._readers = asyncio.Queue()
+            for _ in range(self.readers_count):
+                db = await self._connect()
+                self._all_readers.append(db)
+                self._readers.put_nowait(db)
+            logging.info(f"DB pool opened: {self.path} (1 writer, {self.readers_count} readers)")
+
+    async def close(self):
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                for db in self._all_readers:
+                    await db.close()
+                self._all_readers = []
+                self._readers = None
+                await self._writer.close()
+                self._writer = None
+            logging.info("DB pool closed")
+
+    @asynccontextmanager
+    async def read(self, query: str = "other"):
+        """Borrow a reader connection for the duration of the block; query names it in the metrics."""
+        if not self.is_open:
+            await self.open()
+        requested = time.perf_counter()
+        db = await self._readers.get()
+        acquired = time.perf_counter()
+        DB_WAIT_SECONDS.observe(acquired - requested, op="read", query=query)
+        try:
+            yield db
+        except BaseException:
+            DB_ERRORS.inc(op="read", query=query)
+            raise
+        finally:
+            self._readers.put_nowait(db)
+            DB_SECONDS.observe(time.perf_counter() - acquired, op="read", query=query)
+
+    @asynccontextmanager
+    async def write(self, query: str = "other"):
+        """Exclusive access to the writer. Commits on success, rolls back on error."""
+        if not self.is_open:
+            await self.open()
+        requested = time.perf_counter()
+        async with self._write_lock:
+            acquired = time.perf_counter()
+            DB_WAIT_SECONDS.observe(acquired - requested, op="write", query=query)
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                DB_ERRORS.inc(op="write", query=query)
+                await self._writer.rollback()
+                raise
+            finally:
+                DB_SECONDS.observe(time.perf_counter() - acquired, op="write", query=query)
@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+
+from utils.db_api import get_fsm_record, save_fsm_records, purge_fsm_records
+
+# Pending writes are flushed to SQLite in one transaction at this interval
+FLUSH_INTERVAL = 0.5
+# States untouched for this long are dropped (an admin who walked away mid-flow)
+STATE_TTL = 24 * 3600
+PURGE_INTERVAL = 3600
+# Clean (already persisted) records kept in memory
+CACHE_SIZE = 1024
+
+
+def _encode(value):
+    # FSM data holds dates (hw_date, del_date), which JSON can't store natively
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Can't store {type(value).__name__} in FSM data")
+
+
+def _decode(obj):
+    if "__date__" in obj:
+        return datetime.date.fromisoformat(obj["__date__"])
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def dumps(data) -> str:
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def loads(text: str) -> dict:
+    return json.loads(text, object_hook=_decode) if text else {}
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage in the bot's SQLite database. Reads are served from an
+    in-process cache; writes land in the cache immediately and are flushed
+    to SQLite in batches by a background task.
+    """
+
+    def __init__(self, ttl: float = STATE_TTL, flush_interval: float = FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # key -> [state, data, updated_at]
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._task = None
+        self._last_purge = 0.0
+
+    async def _record(self, key: StorageKey):
+        name = self.key_builder.build(key)
+        record = self._cache.get(name)
+        if record is None:
+            row = await get_fsm_record(name)
+            # Another coroutine may have loaded or written it while we awaited
+            record = self._cache.get(name)
+            if record is None:
+                record = [row[0], loads(row[1]), time.time()] if row else [None, {}, time.time()]
+                self._cache[name] = record
+                self._evict()
+        self._cache.move_to_end(name)
+        return name, record
+
+    def _evict(self):
+        while len(self._cache) > CACHE_SIZE:
+            for name in self._cache:
+                if name not in self._dirty:
+                    del self._cache[name]
+                    break
+            else:
+                return
+
+    def _touch(self, name: str, record):
+        record[2] = time.time()
+        self._dirty.add(name)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flusher())
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        name, record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(name, record)
+
+    async def get_state(self, key: StorageKey):
+        _, record = await self._record(key)
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        name, record = await self._record(key)
+        record[1] = dict(data)
+        self._touch(name, record)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, record = await self._record(key)
+        return record[1].copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        names, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for name in names:
+            state, data, updated_at = self._cache[name]
+            if state is None and not data:
+                deletes.append(name)
+            else:
+                upserts.append((name, state, dumps(data), updated_at))
+        try:
+            await save_fsm_records(upserts, deletes)
+        except Exception:
+            # Keep them dirty so the next flush retries
+            self._dirty |= names
+            raise
+
+    async def purge(self):
+        """Drop states that have not been touched for longer than the TTL."""
+        for name in await purge_fsm_records(time.time() - self.ttl):
+            if name not in self._dirty:
+                self._cache.pop(name, None)
+
+    async def _flusher(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge > PURGE_INTERVAL:
+                    self._last_purge = time.time()
+                    await self.purge()
+            except Exception:
+                logging.exception("Failed to flush FSM storage")
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+
+from keyboards.keyboards import get_next_school_days
+from utils.db_api import cache, get_homework_range
+
+# Same window as the /dzd date picker
+INDEX_DAYS = 10
+
+WEEKDAYS = {
+    "пн": 0, "понедельник": 0, "вт": 1, "вторник": 1, "ср": 2, "среда": 2, "среду": 2,
+    "чт": 3, "четверг": 3, "пт": 4, "пятница": 4, "пятницу": 4, "сб": 5, "суббота": 5, "субботу": 5,
+}
+RELATIVE_DAYS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+
+
+class HomeworkIndex:
+    """
+    Homework for the next school days kept in memory for inline queries.
+    Writes mark their date stale through the query cache's invalidation
+    listener and only stale dates are reloaded, in one range query, on the
+    next lookup. The window moves forward by itself when the day changes.
+    """
+
+    def __init__(self, days: int = INDEX_DAYS):
+        self.days = days
+        self._dates = []
+        self._homework = {}  # {date: {subject: [homework, ...]}}, all classes
+        self._stale = set()
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, namespace=None, *prefix):
+        if namespace is None or (namespace == "hw_subjects" and not prefix):
+            self._stale.update(self._homework)
+        elif namespace == "hw_subjects":
+            hw_date = prefix[0]
+            if isinstance(hw_date, str):
+                hw_date = datetime.date.fromisoformat(hw_date)
+            self._stale.add(hw_date)
+
+    async def _refresh(self, today: datetime.date):
+        dates = get_next_school_days(self.days, today=today)
+        if dates != self._dates:
+            self._dates = dates
+            self._homework = {d: self._homework[d] for d in dates if d in self._homework}
+            self._stale.update(d for d in dates if d not in self._homework)
+        # Dates past the window are loaded anyway once they enter it
+        self._stale.intersection_update(dates)
+        if not self._stale:
+            return
+        # Cleared before loading: an invalidation that lands during the load marks the date again
+        stale = sorted(self._stale)
+        self._stale.clear()
+        try:
+            loaded = await get_homework_range(stale[0], stale[-1])
+        except BaseException:
+            self._stale.update(stale)
+            raise
+        for hw_date in stale:
+            self._homework[hw_date] = loaded.get(hw_date, {})
+
+    async def search(self, query: str, grade=None, today: datetime.date = None, limit: int = 50) -> list:
+        """
+        Homework matching an inline query, as [(date, subject, [homework, ...]), ...].
+        Words naming a day ("завтра", "пт", "21.10") pick dates, the rest must
+        all occur in the subject name. grade filters like the /dzd views do.
+        """
+        today = today or datetime.date.today()
+        async with self._lock:
+            await self._refresh(today)
+
+        dates, words = parse_query(query, today)
+        results = []
+        for hw_date in self._dates:
+            if dates and hw_date not in dates:
+                continue
+            for subject, items in self._homework.get(hw_date, {}).items():
+                if grade:
+                    items = [item for item in items if item['grade'] in ('', grade)]
+                if not items or not all(word in subject.casefold() for word in words):
+                    continue
+                results.append((hw_date, subject, items))
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+def parse_query(query: str, today: datetime.date):
+    """Split an inline query into the set of dates it names and the remaining words."""
+    dates, words = set(), []
+    for word in query.casefold().split():
+        word = word.strip(",")
+        if word in RELATIVE_DAYS:
+            dates.add(today + datetime.timedelta(days=RELATIVE_DAYS[word]))
+        elif word in WEEKDAYS:
+            dates.add(today + datetime.timedelta(days=(WEEKDAYS[word] - today.weekday()) % 7))
+        elif (day := _parse_day(word, today)) is not None:
+            dates.add(day)
+        elif word:
+            words.append(word)
+    return dates, words
+
+
+def _parse_day(word: str, today: datetime.date):
+    """'21.10', '21.10.26' or '21.10.2026' -> date; a day-month already past means next year"""
+    parts = word.split(".")
+    if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+        return None
+    day, month = int(parts[0]), int(parts[1])
+    try:
+        if len(parts) == 3:
+            year = int(parts[2])
+            return datetime.date(year + 2000 if year < 100 else year, month, day)
+        result = datetime.date(today.year, month, day)
+        return result if result >= today else datetime.date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+homework_index = HomeworkIndex()
+cache.add_listener(homework_index.invalidate)
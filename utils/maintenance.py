@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from config import HW_RETENTION_DAYS, HW_RETENTION_MODE, BROADCAST_RETENTION_DAYS
+from utils.db_api import (
+    cache, archive_homework_batch, prune_broadcast_jobs, get_db_pages, incremental_vacuum, optimize_db
+)
+
+# Homework rows moved per write transaction
+ARCHIVE_BATCH = 500
+# Finished broadcasts deleted per write transaction (each with one row per chat)
+PRUNE_BATCH = 50
+# Free pages returned to the filesystem per write transaction
+VACUUM_BATCH = 2000
+# Pause between batches so queued writes (new homework, FSM flushes) get the writer
+BATCH_PAUSE = 0.05
+
+
+async def run_maintenance(days: int = HW_RETENTION_DAYS, mode: str = HW_RETENTION_MODE,
+                          broadcast_days: int = BROADCAST_RETENTION_DAYS) -> dict:
+    """
+    Nightly job: archive (or delete) homework older than `days`, drop broadcasts
+    finished more than `broadcast_days` ago, give the freed pages back to the
+    filesystem and refresh planner statistics. Every step holds the writer only
+    briefly. Returns a report with the reclaimed bytes.
+    """
+    before = await get_db_pages()
+    moved = 0
+    if days > 0:
+        cutoff = date.today() - timedelta(days=days)
+        while True:
+            count = await archive_homework_batch(cutoff, ARCHIVE_BATCH, keep=mode != "delete")
+            moved += count
+            if count < ARCHIVE_BATCH:
+                break
+            await asyncio.sleep(BATCH_PAUSE)
+        if moved:
+            cache.invalidate("hw_subjects")
+            cache.invalidate("day_subjects")
+
+    # Reminders alone add a job and a row per chat every day
+    broadcasts = 0
+    if broadcast_days > 0:
+        while True:
+            count = await prune_broadcast_jobs(broadcast_days, PRUNE_BATCH)
+            broadcasts += count
+            if count < PRUNE_BATCH:
+                break
+            await asyncio.sleep(BATCH_PAUSE)
+
+    while await incremental_vacuum(VACUUM_BATCH):
+        await asyncio.sleep(BATCH_PAUSE)
+    await optimize_db()
+
+    after = await get_db_pages()
+    report = {
+        'homework': moved,
+        'broadcasts': broadcasts,
+        'mode': mode,
+        'size_before': before['pages'] * before['page_size'],
+        'size_after': after['pages'] * after['page_size'],
+    }
+    report['reclaimed'] = report['size_before'] - report['size_after']
+    logging.info(
+        f"Maintenance: {moved} homework rows {'deleted' if mode == 'delete' else 'archived'}, "
+        f"{broadcasts} old broadcasts deleted, "
+        f"DB {report['size_before'] / 1024:.0f} KiB -> {report['size_after'] / 1024:.0f} KiB "
+        f"({report['reclaimed'] / 1024:.0f} KiB reclaimed)"
+    )
+    return report
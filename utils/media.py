@@ -0,0 +1,76 @@
+from itertools import groupby
+
+# Telegram limits for albums, media captions and messages
+MEDIA_GROUP_LIMIT = 10
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# Albums can't mix photos with documents, so each kind is grouped separately
+ALBUM_ORDER = ("photo", "document")
+
+
+def group_attachments(attachments):
+    """
+    Split attachments into albums: photos first, then documents, at most 10 per album.
+    attachments: list of dicts [{'file_id': '...', 'file_type': 'photo/document'}]
+    Returns a list of (file_type, [file_id, ...]).
+    """
+    ordered = sorted(
+        (a for a in attachments if a['file_type'] in ALBUM_ORDER),
+        key=lambda a: ALBUM_ORDER.index(a['file_type'])
+    )
+    albums = []
+    for file_type, items in groupby(ordered, key=lambda a: a['file_type']):
+        file_ids = [a['file_id'] for a in items]
+        for i in range(0, len(file_ids), MEDIA_GROUP_LIMIT):
+            albums.append((file_type, file_ids[i:i + MEDIA_GROUP_LIMIT]))
+    return albums
+
+
+def pack_text(blocks, separator: str = "\n\n", limit: int = MESSAGE_LIMIT):
+    """
+    Join text blocks into as few messages as possible, each at most `limit` long.
+    Blocks are kept whole unless a single block is longer than a message.
+    """
+    messages = []
+    current = ""
+    for block in blocks:
+        for i in range(0, len(block), limit):
+            piece = block[i:i + limit]
+            if current and len(current) + len(separator) + len(piece) <= limit:
+                current += separator + piece
+            else:
+                if current:
+                    messages.append(current)
+                current = piece
+    if current:
+        messages.append(current)
+    return messages
+
+
+def media_payload(text: str, attachments, parse_mode: str = None):
+    """
+    Bot API calls that deliver `text` with its attachments as albums.
+    The text becomes the caption of the first album item when it fits,
+    otherwise it is sent as a separate message first. Plain text unless
+    parse_mode is given.
+    Returns a list of {"method": ..., **params} dicts without chat_id.
+    """
+    albums = group_attachments(attachments or [])
+    payload = []
+    caption = text
+    if not albums or len(text) > CAPTION_LIMIT:
+        payload.append({'method': 'send_message', 'text': text, 'parse_mode': parse_mode})
+        caption = None
+
+    for file_type, file_ids in albums:
+        extra = {'caption': caption, 'parse_mode': parse_mode} if caption else {}
+        if len(file_ids) == 1:
+            # A one-item album is rejected by Telegram; send the file directly
+            payload.append({'method': f'send_{file_type}', file_type: file_ids[0], **extra})
+        else:
+            media = [{'type': file_type, 'media': file_id} for file_id in file_ids]
+            media[0].update(extra)
+            payload.append({'method': 'send_media_group', 'media': media})
+        caption = None
+    return payload
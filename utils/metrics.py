@@ -0,0 +1,201 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+# Minimal in-process metrics rendered in the Prometheus text format (version 0.0.4).
+# Everything runs on one event loop, so plain dicts are enough - no locks.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers fast SQLite reads up to slow Telegram calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, list(zip(self.labelnames, key)), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, pairs, value in self._samples():
+            lines.append(f"{name}{_labels(pairs)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() at scrape time."""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            self._values[()] = self._function()
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # [count per bucket (last one is +Inf), sum, count]
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        for key, (counts, total, count) in self._values.items():
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", pairs + [("le", bound)], cumulative
+            yield f"{self.name}_sum", pairs, total
+            yield f"{self.name}_count", pairs, count
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# Dispatcher
+UPDATES = Counter("bot_updates_total", "Updates received, by type and outcome", ["type", "outcome"])
+UPDATE_SECONDS = Histogram("bot_update_duration_seconds", "Time spent processing an update", ["type"])
+UPDATE_WAIT_SECONDS = Histogram("bot_update_wait_seconds", "Time an update waited for its chat queue and a slot")
+UPDATES_RUNNING = Gauge("bot_updates_running", "Updates being processed right now")
+UPDATES_WAITING = Gauge("bot_updates_waiting", "Updates waiting for their chat queue or a slot")
+
+# Telegram Bot API
+API_REQUESTS = Counter("bot_api_requests_total", "Bot API requests, by method and result", ["method", "result"])
+API_SECONDS = Histogram("bot_api_request_duration_seconds", "Bot API request latency", ["method"])
+
+# SQLite
+# query is the db_api function that borrowed the connection
+DB_SECONDS = Histogram("bot_db_duration_seconds", "Time a DB connection was held, by kind and query", ["op", "query"])
+DB_WAIT_SECONDS = Histogram("bot_db_wait_seconds", "Time spent waiting for a DB connection", ["op", "query"])
+DB_ERRORS = Counter("bot_db_errors_total", "DB blocks that raised, by kind and query", ["op", "query"])
+CACHE_LOOKUPS = Counter("bot_cache_lookups_total", "Query cache lookups, by result", ["result"])
+CACHE_ENTRIES = Gauge("bot_cache_entries", "Entries in the query cache")
+
+# Broadcasts
+BROADCAST_CHATS = Counter("bot_broadcast_chats_total", "Chats a broadcast finished for, by status", ["status"])
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "API calls made by broadcasts")
+BROADCAST_SECONDS = Histogram("bot_broadcast_duration_seconds", "Duration of whole broadcasts",
+                              buckets=(1, 5, 15, 60, 300, 900, 1800, 3600))
+BROADCAST_THROUGHPUT = Gauge("bot_broadcast_throughput", "API calls per second of the last broadcast")
+FLOOD_WAITS = Counter("bot_flood_waits_total", "Flood waits (429) hit while broadcasting")
+
+# Background schedulers
+DELETION_LAG = Histogram("bot_deletion_lag_seconds", "Delay between a message's due time and its deletion",
+                         buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+DELETIONS_PENDING = Gauge("bot_deletions_pending", "Messages scheduled for deletion")
+JOB_LAG = Histogram("bot_job_lag_seconds", "Delay between a scheduled job's run time and its start",
+                    buckets=(0.01, 0.1, 0.5, 1, 5, 30, 60))
+JOB_ERRORS = Counter("bot_job_errors_total", "Scheduled jobs that failed or were missed", ["job", "reason"])
+
+# Event loop
+LOOP_LAG = Gauge("bot_event_loop_lag_seconds", "How late the last event loop probe woke up")
+LOOP_LAG_SECONDS = Histogram("bot_event_loop_lag_hist_seconds", "Event loop probe lateness",
+                             buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+LOOP_PROBE_INTERVAL = 0.5
+_loop_task = None
+
+
+async def _probe_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_PROBE_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_PROBE_INTERVAL)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag > 1:
+            logging.warning(f"Event loop blocked for {lag:.2f}s")
+
+
+def loop_lag() -> float:
+    return LOOP_LAG._values.get((), 0.0)
+
+
+def start_loop_monitor():
+    global _loop_task
+    if _loop_task is None or _loop_task.done():
+        _loop_task = asyncio.create_task(_probe_loop())
+
+
+async def stop_loop_monitor():
+    global _loop_task
+    if _loop_task:
+        _loop_task.cancel()
+        try:
+            await _loop_task
+        except asyncio.CancelledError:
+            pass
+        _loop_task = None
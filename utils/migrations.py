@@ -0,0 +1,302 @@
+import logging
+import re
+
+def parse_schedule_text(schedule_text) -> list:
+    """Split a legacy schedule blob ("1. Math\n2. ...") into subject names."""
+    subjects = []
+    for line in (schedule_text or "").split('\n'):
+        line = line.strip()
+        if not line: continue
+        # Try to match Number. Subject or just Subject
+        match = re.match(r'^\d+[\.\)]\s*(.*)', line)
+        subjects.append(match.group(1).strip() if match else line)
+    return subjects
+
+
+async def _split_schedule_blobs(db):
+    async with db.execute("SELECT day_name, lessons FROM schedule") as cursor:
+        rows = await cursor.fetchall()
+    await db.executemany(
+        "INSERT OR REPLACE INTO lessons (day_name, position, subject) VALUES (?, ?, ?)",
+        [
+            (day_name, position, subject)
+            for day_name, text in rows
+            for position, subject in enumerate(parse_schedule_text(text), 1)
+        ]
+    )
+
+
+def outside_transaction(step):
+    """
+    Mark a callable step that SQLite refuses to run inside a transaction (VACUUM).
+    It runs on its own before the migration's transaction, so it must be safe to repeat.
+    """
+    step.outside_transaction = True
+    return step
+
+
+@outside_transaction
+async def _enable_incremental_vacuum(db):
+    # auto_vacuum can only be switched on by a full VACUUM; after that freed pages
+    # are returned in small steps by PRAGMA incremental_vacuum (see utils/maintenance.py)
+    async with db.execute("PRAGMA auto_vacuum") as cursor:
+        if (await cursor.fetchone())[0] == 2:
+            return
+    await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    await db.execute("VACUUM")
+
+
+# Ordered schema migrations. Each entry is (version, description, steps);
+# a step is either an SQL string or an async callable taking the writer connection.
+# All steps of a migration commit or roll back together (see migrate()).
+# Never edit an applied migration - append a new one instead.
+MIGRATIONS = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS homework (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject TEXT NOT NULL,
+            grade TEXT,
+            hw_date DATE NOT NULL,
+            description TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS homework_attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            homework_id INTEGER,
+            file_id TEXT,
+            file_type TEXT,
+            FOREIGN KEY(homework_id) REFERENCES homework(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS schedule (
+            day_name TEXT PRIMARY KEY,
+            lessons TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY
+        )
+        """,
+    ]),
+    (2, "homework indexes, drop orphan attachments", [
+        # Foreign keys were never enforced before, so deleted homework left its files behind
+        "DELETE FROM homework_attachments WHERE homework_id IS NULL OR homework_id NOT IN (SELECT id FROM homework)",
+        "CREATE INDEX IF NOT EXISTS idx_homework_date_subject ON homework(hw_date, subject)",
+        "CREATE INDEX IF NOT EXISTS idx_attachments_homework ON homework_attachments(homework_id)",
+        "ANALYZE",
+    ]),
+    (3, "broadcast outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            reply_chat_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_outbox (
+            job_id INTEGER NOT NULL REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            updated_at DATETIME,
+            PRIMARY KEY (job_id, chat_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON broadcast_outbox(job_id, chat_id) WHERE status = 'pending'",
+    ]),
+    (4, "chat activity tracking", [
+        "ALTER TABLE chats ADD COLUMN is_active INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE chats ADD COLUMN deactivated_at DATETIME",
+        "ALTER TABLE chats ADD COLUMN last_error TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_chats_active ON chats(chat_id) WHERE is_active = 1",
+    ]),
+    (5, "pending message deletions", [
+        """
+        CREATE TABLE IF NOT EXISTS pending_deletions (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            delete_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (6, "structured timetable", [
+        """
+        CREATE TABLE IF NOT EXISTS lessons (
+            day_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            PRIMARY KEY (day_name, position)
+        ) WITHOUT ROWID
+        """,
+        _split_schedule_blobs,
+    ]),
+    (7, "persistent FSM storage", [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)",
+    ]),
+    (8, "subject dictionary", [
+        """
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """,
+        """
+        INSERT OR IGNORE INTO subjects (name)
+        SELECT subject FROM lessons UNION SELECT subject FROM homework
+        """,
+    ]),
+    (9, "classes", [
+        # '' is "all classes" for homework and the default timetable for lessons/schedule;
+        # chats.grade stays NULL for chats that want everything
+        "ALTER TABLE chats ADD COLUMN grade TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_chats_grade ON chats(grade) WHERE is_active = 1",
+        "UPDATE homework SET grade = '' WHERE grade IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_homework_grade_date ON homework(grade, hw_date)",
+        """
+        CREATE TABLE lessons_by_grade (
+            grade TEXT NOT NULL DEFAULT '',
+            day_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            PRIMARY KEY (grade, day_name, position)
+        ) WITHOUT ROWID
+        """,
+        "INSERT INTO lessons_by_grade (day_name, position, subject) SELECT day_name, position, subject FROM lessons",
+        "DROP TABLE lessons",
+        "ALTER TABLE lessons_by_grade RENAME TO lessons",
+        """
+        CREATE TABLE schedule_by_grade (
+            grade TEXT NOT NULL DEFAULT '',
+            day_name TEXT NOT NULL,
+            lessons TEXT,
+            PRIMARY KEY (grade, day_name)
+        )
+        """,
+        "INSERT INTO schedule_by_grade (day_name, lessons) SELECT day_name, lessons FROM schedule",
+        "DROP TABLE schedule",
+        "ALTER TABLE schedule_by_grade RENAME TO schedule",
+    ]),
+    (10, "per-chat reminder times", [
+        # 'HH:MM' in server time; NULL means the chat opted out. Existing chats keep the old 15:00
+        "ALTER TABLE chats ADD COLUMN remind_at TEXT DEFAULT '15:00'",
+        "CREATE INDEX IF NOT EXISTS idx_chats_remind_at ON chats(remind_at) WHERE is_active = 1",
+        # Seconds to spread a broadcast's sends over (0 = as fast as the rate limits allow)
+        "ALTER TABLE broadcast_jobs ADD COLUMN spread REAL NOT NULL DEFAULT 0",
+    ]),
+    (11, "homework full-text search", [
+        # External-content index: the text lives in homework only, triggers keep the index in step
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS homework_fts USING fts5(
+            subject, description,
+            content='homework', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS homework_fts_insert AFTER INSERT ON homework BEGIN
+            INSERT INTO homework_fts (rowid, subject, description) VALUES (new.id, new.subject, new.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS homework_fts_delete AFTER DELETE ON homework BEGIN
+            INSERT INTO homework_fts (homework_fts, rowid, subject, description)
+            VALUES ('delete', old.id, old.subject, old.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS homework_fts_update AFTER UPDATE OF subject, description ON homework BEGIN
+            INSERT INTO homework_fts (homework_fts, rowid, subject, description)
+            VALUES ('delete', old.id, old.subject, old.description);
+            INSERT INTO homework_fts (rowid, subject, description) VALUES (new.id, new.subject, new.description);
+        END
+        """,
+        "INSERT INTO homework_fts (homework_fts) VALUES ('rebuild')",
+    ]),
+    (12, "homework archive, incremental vacuum", [
+        _enable_incremental_vacuum,
+        """
+        CREATE TABLE IF NOT EXISTS homework_archive (
+            id INTEGER PRIMARY KEY,
+            subject TEXT NOT NULL,
+            grade TEXT,
+            hw_date DATE NOT NULL,
+            description TEXT,
+            created_at DATETIME,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS homework_attachments_archive (
+            id INTEGER PRIMARY KEY,
+            homework_id INTEGER NOT NULL,
+            file_id TEXT,
+            file_type TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_homework_archive_date ON homework_archive(hw_date)",
+        "CREATE INDEX IF NOT EXISTS idx_attachments_archive_homework ON homework_attachments_archive(homework_id)",
+    ]),
+]
+
+
+async def get_schema_version(db) -> int:
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    async with db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] or 0
+
+
+async def migrate(pool):
+    """Apply pending migrations in order, each one in its own transaction."""
+    async with pool.write("migrate") as db:
+        current = await get_schema_version(db)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        for step in steps:
+            if getattr(step, "outside_transaction", False):
+                async with pool.write("migrate") as db:
+                    await step(db)
+        async with pool.write("migrate") as db:
+            # sqlite3 only opens a transaction by itself before DML; without this
+            # ALTER/CREATE would commit one by one and a failed step would leave them applied
+            await db.execute("BEGIN")
+            for step in steps:
+                if getattr(step, "outside_transaction", False):
+                    continue
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+        logging.info(f"DB migrated to version {version}: {description}")
+        current = version
+    return current
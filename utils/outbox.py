@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+
+from utils.broadcast import broadcast
+from utils.db_api import (
+    create_broadcast_job, get_unfinished_broadcast_jobs, get_pending_broadcast_chats,
+    save_broadcast_results, finish_broadcast_job, get_broadcast_progress
+)
+
+# Delivery statuses are flushed to SQLite in batches of this size. After a crash
+# at most one batch per job is sent twice (delivery is at-least-once).
+FLUSH_EVERY = 25
+# The worker also rescans the outbox this often, in case a wakeup was missed
+IDLE_RESCAN = 60
+
+_wakeup = asyncio.Event()
+_worker_task = None
+# Jobs run concurrently (a spread-out reminder must not hold up a homework notification);
+# they still share one rate limiter. job id -> task
+_running = {}
+
+
+def build_steps(bot: Bot, payload: list):
+    """
+    Turn a stored payload into broadcast steps. Each payload item is a dict with
+    a Bot method name and its keyword arguments except chat_id, e.g.
+    {"method": "send_message", "text": "...", "parse_mode": "Markdown"}.
+    """
+    steps = []
+    for call in payload:
+        params = dict(call)
+        method = getattr(bot, params.pop("method"))
+        steps.append(lambda chat_id, method=method, params=params: method(chat_id=chat_id, **params))
+    return steps
+
+
+async def enqueue_broadcast(title: str, payload: list, chat_ids, reply_chat_id: int = None, spread: float = 0) -> int:
+    """
+    Persist a broadcast for background delivery. Returns the job id.
+    spread: seconds to spread the sends over (see broadcast()).
+    """
+    job_id = await create_broadcast_job(title, payload, chat_ids, reply_chat_id, spread)
+    _wakeup.set()
+    return job_id
+
+
+def format_progress(job: dict) -> str:
+    done = job['total'] - job['pending']
+    state = "завершена" if job['finished_at'] else "в процессе"
+    return (
+        f"#{job['id']} «{job['title']}» — {state}\n"
+        f"   {done}/{job['total']}: ✅ {job['delivered']}  🚫 {job['blocked']}  ⚠ {job['failed']}"
+    )
+
+
+async def _run_job(bot: Bot, job: dict):
+    chat_ids = await get_pending_broadcast_chats(job['id'])
+    buffer = []
+
+    async def on_result(chat_id, status, error):
+        buffer.append((chat_id, status, str(error) if error else None))
+        if len(buffer) >= FLUSH_EVERY:
+            batch = buffer[:]
+            buffer.clear()
+            await save_broadcast_results(job['id'], batch)
+
+    if chat_ids:
+        logging.info(f"Outbox: job #{job['id']} '{job['title']}', {len(chat_ids)} chats pending")
+    result = await broadcast(chat_ids, build_steps(bot, job['payload']), on_result=on_result, spread=job['spread'])
+    if buffer:
+        await save_broadcast_results(job['id'], buffer)
+    await finish_broadcast_job(job['id'])
+
+    if job['reply_chat_id']:
+        progress = (await get_broadcast_progress([job['id']]))[0]
+        try:
+            await bot.send_message(
+                job['reply_chat_id'],
+                f"📬 Рассылка завершена.\n{format_progress(progress)}\n"
+                f"⏱ {result.elapsed:.1f} с, {result.throughput:.1f} сообщ./с"
+            )
+        except Exception as e:
+            logging.warning(f"Outbox: failed to report job #{job['id']}: {e}")
+
+
+def _job_done(job_id: int, task: asyncio.Task):
+    _running.pop(job_id, None)
+    if not task.cancelled() and task.exception():
+        # Left unfinished in the database, so the next scan retries it
+        logging.error(f"Outbox: job #{job_id} failed, retrying later", exc_info=task.exception())
+
+
+async def _worker(bot: Bot):
+    while True:
+        _wakeup.clear()
+        try:
+            for job in await get_unfinished_broadcast_jobs():
+                if job['id'] not in _running:
+                    task = asyncio.create_task(_run_job(bot, job))
+                    _running[job['id']] = task
+                    task.add_done_callback(lambda task, job_id=job['id']: _job_done(job_id, task))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Outbox worker failed, retrying later")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), IDLE_RESCAN)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_outbox_worker(bot: Bot):
+    """Start draining the outbox; unfinished jobs from a previous run are resumed."""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker(bot))
+    return _worker_task
+
+
+async def stop_outbox_worker():
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+    # Interrupted jobs stay pending in the database and resume on the next start
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)